@@ -1,6 +1,6 @@
 import os
 import configparser
-from typing import Any
+from typing import Any, Dict
 
 class Config:
     def __init__(self):
@@ -19,6 +19,16 @@ class Config:
     def get(self, section: str, key: str, fallback: Any = None) -> Any:
         return self.config.get(section, key, fallback=fallback)
 
+    # Override a value at runtime, e.g. to point the pipeline at local stand-in services.
+    def set(self, section: str, key: str, value: Any):
+        if not self.config.has_section(section):
+            self.config.add_section(section)
+        self.config.set(section, key, str(value))
+
+    # A whole section as a dict, empty when the section is missing.
+    def section(self, section: str) -> Dict[str, str]:
+        return dict(self.config.items(section)) if self.config.has_section(section) else {}
+
 # Create a global instance of the Config class
 config = Config()
 
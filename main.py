@@ -1,4 +1,7 @@
+import os
 import sys
+import json
+import logging
 import argparse
 from src.pipeline.pipeline import ContextualRAGPipeline
 from config import config
@@ -40,23 +43,72 @@ def load_file_content(file_path):
         print(f"Error reading PDF file: {e}")
         return None, None
 
-def list_knowledge_base(pipeline):
-    all_docs = pipeline.vector_store.get_all_documents()
-    if not all_docs:
+# Pages through the vector store rather than loading it whole, so memory stays flat however large it is.
+def list_knowledge_base(pipeline, batch_size=1000):
+    if not pipeline.vector_store.count():
         print("The knowledge base is empty.")
-    else:
-        print(f"Knowledge Base Contents: ")
-        for i, (doc_id, text) in enumerate(zip(all_docs['ids'], all_docs['documents']), 1):
-            print(f"{i}. ID: {doc_id}")
-            print(f"   Content: {text[:100]}...")  # Display first 100 characters
-            print()
-        print(f"---- End of the Knowledge Base ----")
+        return
+    print(f"Knowledge Base Contents: ")
+    for i, doc in enumerate(pipeline.vector_store.iter_documents(batch_size=batch_size, include=["documents"]), 1):
+        print(f"{i}. ID: {doc['id']}")
+        print(f"   Content: {doc['text'][:100]}...")  # Display first 100 characters
+        print()
+    print(f"---- End of the Knowledge Base ----")
+
+# Stream the knowledge base as JSON lines ({"id", "text", "metadata"[, "embedding"]}) to a file, or stdout for "-".
+def export_knowledge_base(pipeline, path, include_embeddings=False, batch_size=1000):
+    include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+    out = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+    count = 0
+    try:
+        for doc in pipeline.vector_store.iter_documents(batch_size=batch_size, include=include):
+            out.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Exported {count} chunks to {path}.", file=sys.stderr)
+
+# Bring the knowledge base in line with a directory of documents. Unchanged files are skipped
+# and changed files only re-embed the chunks that differ, so a periodic re-sync costs the delta.
+# Documents are keyed by their path relative to the directory, so same-named files in different
+# subdirectories stay separate documents, and record the directory as their source, so pruning
+# only removes documents synced from this directory.
+def sync_directory(pipeline, directory, prune=False):
+    source = os.path.abspath(directory)
+    seen = set()
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(('.pdf', '.txt', '.md')):
+                continue
+            path = os.path.join(root, name)
+            file_content, metadata = load_file_content(path)
+            if file_content and metadata:
+                metadata['file_name'] = os.path.relpath(path, directory).replace(os.sep, '/')
+                seen.add(metadata['file_name'])
+                pipeline.add_document(file_content, metadata, source=source)
+            else:
+                print(f"Failed to load file content: {name}")
+    if prune:
+        for file_name in pipeline.document_manifest.list_documents(source=source):
+            if file_name not in seen:
+                pipeline.remove_document(file_name)
+                print(f"Removed {file_name} from the knowledge base.")
+    print(f"Synced {len(seen)} files from {directory}.")
 
 def main():
     parser = argparse.ArgumentParser(description="Contextual RAG Pipeline")
     parser.add_argument('--list_kb', action='store_true', help='List the contents of the knowledge base')
+    parser.add_argument('--export_kb', metavar='PATH', help='Export the knowledge base as JSON lines ("-" for stdout)')
+    parser.add_argument('--with_embeddings', action='store_true', help='With --export_kb, include the stored embeddings. These are the vectors as the backend stores them: '
+                             'the numpy backend returns normalised vectors (dequantised for int8), not the originals')
+    parser.add_argument('--snapshot', metavar='DIR', help='Write a snapshot of the knowledge base to a directory')
+    parser.add_argument('--restore', metavar='DIR', help='Replace the knowledge base with a snapshot, without re-embedding')
     parser.add_argument('--clear_kb', action='store_true', help='Clear the knowledge base')
+    parser.add_argument('--sync_dir', help='Incrementally ingest every PDF/text file in a directory')
+    parser.add_argument('--prune', action='store_true', help='With --sync_dir, remove documents synced from that directory whose files are gone')
     args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
      # Check if SERPAPI_API_KEY is set
     if not config.get('API', 'SERPAPI_API_KEY'):
@@ -69,12 +121,31 @@ def main():
     if args.list_kb:
         list_knowledge_base(pipeline)
         return
+
+    if args.export_kb:
+        export_knowledge_base(pipeline, args.export_kb, include_embeddings=args.with_embeddings)
+        return
     
+    if args.snapshot:
+        pipeline.create_snapshot(args.snapshot)
+        return
+
+    if args.restore:
+        pipeline.restore_snapshot(args.restore)
+        return
+
     if args.clear_kb:
-        pipeline.vector_store.clear_database()
+        pipeline.clear_knowledge_base()
         print("Knowledge base has been cleared.")
         return
 
+    if args.sync_dir:
+        sync_directory(pipeline, args.sync_dir, prune=args.prune)
+        return
+
+    if config.get('MODELS', 'WARM_ON_STARTUP', fallback='false').lower() == 'true':
+        pipeline.warm_models()
+
     while True:
         print("\nOptions:")
         print("1. Upload a file (PDF or utf-8 text only): ")
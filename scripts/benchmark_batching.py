@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.evaluation.fake_services import FakeServices
+from src.evaluation.metrics import latency_summary
+from src.retriever.contextual_embeddings import ContextualEmbeddings, OllamaEmbeddings, CoalescingEmbeddingProvider
+
+
+# Each worker embeds single queries back to back, as concurrent process_query calls do. With
+# distinct_contexts every worker has its own context, like queries with different histories.
+def run(embeddings: ContextualEmbeddings, concurrency: int, requests_per_worker: int, distinct_contexts: bool = False) -> dict:
+    def worker(worker_id):
+        context = f"history of caller {worker_id}" if distinct_contexts else ""
+        latencies = []
+        for i in range(requests_per_worker):
+            start = time.perf_counter()
+            embeddings.generate_embeddings([f"query {worker_id} number {i}"], context)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [ms for result in pool.map(worker, range(concurrency)) for ms in result]
+    elapsed = time.perf_counter() - start
+    return {"requests_per_second": len(latencies) / elapsed, "latency": latency_summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding throughput under concurrent load, with and without request coalescing")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma separated numbers of concurrent callers")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per caller")
+    parser.add_argument("--embed_latency", type=float, default=0.02, help="Seconds per embedding request on the fake Ollama")
+    parser.add_argument("--embed_latency_per_item", type=float, default=0.001, help="Seconds per input in a batched request")
+    parser.add_argument("--ollama_parallel", type=int, default=1,
+                        help="Requests the fake Ollama serves at once, like OLLAMA_NUM_PARALLEL (0 for unlimited)")
+    parser.add_argument("--max_batch_size", type=int, default=32)
+    parser.add_argument("--max_wait_ms", type=float, default=5.0)
+    parser.add_argument("--distinct_contexts", action="store_true", help="Give every caller its own embedding context")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with FakeServices(embed_latency=args.embed_latency, embed_latency_per_item=args.embed_latency_per_item,
+                      ollama_parallel=args.ollama_parallel or None) as services:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            # "coalesced_per_text" batches requests but sends each text on its own, as /api/embeddings requires
+            providers = {
+                "direct": OllamaEmbeddings(host=services.url),
+                "coalesced_per_text": CoalescingEmbeddingProvider(
+                    OllamaEmbeddings(host=services.url), max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms),
+                "coalesced": CoalescingEmbeddingProvider(
+                    OllamaEmbeddings(host=services.url, batch_endpoint=True),
+                    max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms),
+            }
+            for mode, provider in providers.items():
+                result = {"mode": mode, "concurrency": concurrency,
+                          **run(ContextualEmbeddings(provider), concurrency, args.requests, args.distinct_contexts)}
+                results.append(result)
+                print(f"{mode:>18} concurrency={concurrency:<4} {result['requests_per_second']:8.1f} req/s "
+                      f"p50={result['latency']['p50_ms']:7.2f}ms p95={result['latency']['p95_ms']:7.2f}ms")
+                if isinstance(provider, CoalescingEmbeddingProvider):
+                    provider.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.evaluation.benchmark import run_benchmark, compare_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput benchmark for ContextualRAGPipeline "
+                                                 "against local stand-ins for Ollama and SerpAPI")
+    parser.add_argument("--documents", type=int, default=100, help="Number of synthetic documents to ingest")
+    parser.add_argument("--sentences", type=int, default=20, help="Sentences per synthetic document")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries to run")
+    parser.add_argument("--backend", default="chroma", help="Vector store backend: chroma or numpy")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shard worker processes")
+    parser.add_argument("--embedding_dim", type=int, default=256)
+    parser.add_argument("--embed_latency", type=float, default=0.0, help="Seconds per embeddings request")
+    parser.add_argument("--generate_latency", type=float, default=0.0, help="Seconds per generate request")
+    parser.add_argument("--generate_latency_per_token", type=float, default=0.0,
+                        help="Additional seconds per prompt token, to model prefill cost")
+    parser.add_argument("--search_latency", type=float, default=0.0, help="Seconds per web search request")
+    parser.add_argument("--model_load_latency", type=float, default=0.0,
+                        help="Seconds the fake Ollama takes to load a model that is not resident")
+    parser.add_argument("--max_loaded_models", type=int, default=None,
+                        help="How many models the fake Ollama keeps loaded at once (unlimited by default)")
+    parser.add_argument("--trace_memory", action="store_true", help="Track Python allocations with tracemalloc (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_documents=args.documents, num_queries=args.queries, sentences_per_document=args.sentences,
+        backend=args.backend, embedding_dim=args.embedding_dim, embed_latency=args.embed_latency,
+        generate_latency=args.generate_latency, generate_latency_per_token=args.generate_latency_per_token,
+        search_latency=args.search_latency, model_load_latency=args.model_load_latency,
+        max_loaded_models=args.max_loaded_models, trace_memory=args.trace_memory, seed=args.seed,
+        num_shards=args.shards,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    ingestion = results["ingestion"]
+    print(f"Ingestion: {ingestion['documents_per_second']:.1f} docs/s, {ingestion['chunks_per_second']:.1f} chunks/s")
+    print(f"Query: p50={results['query_latency']['p50_ms']:.1f}ms p95={results['query_latency']['p95_ms']:.1f}ms")
+    for stage, summary in results["stage_latency"].items():
+        if summary["count"]:
+            print(f"  {stage:>16}: p50={summary['p50_ms']:8.2f}ms p95={summary['p95_ms']:8.2f}ms")
+    print(f"Peak RSS: {results['memory']['max_rss_end_mb']:.1f} MiB")
+    if results['memory']['max_rss_shard_worker_mb'] is not None:
+        print(f"Peak shard worker RSS: {results['memory']['max_rss_shard_worker_mb']:.1f} MiB")
+    print(f"Model loads: {results['backend_requests']['model_loads']}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
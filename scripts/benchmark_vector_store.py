@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import List
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.retriever.contextual_embeddings import EmbeddingProvider
+from src.retriever.vector_store import VectorStore
+from src.retriever.numpy_vector_store import NumpyVectorStore
+from src.retriever.sharding import ShardPool, ShardedVectorStore
+
+
+# Serves precomputed random vectors so the benchmark measures the index, not Ollama.
+# Texts are the string form of the row number in the generated matrix.
+class MatrixEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def generate_embeddings(self, texts: List[str], context: str) -> List[List[float]]:
+        return self.vectors[[int(text) for text in texts]].tolist()
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def make_store(backend: str, path: str, provider: EmbeddingProvider, shards: int = 1):
+    if shards > 1:
+        name, _, dtype = backend.partition("-")
+        pool = ShardPool(num_shards=shards, backend=name, persist_directory=path, dtype=dtype or "float32")
+        return ShardedVectorStore(pool, embedding_provider=provider)
+    if backend == "chroma":
+        return VectorStore(persist_directory=path, embedding_provider=provider)
+    return NumpyVectorStore(persist_directory=path, embedding_provider=provider, dtype=backend.split("-")[1])
+
+
+def run(backend: str, size: int, dim: int, num_queries: int, top_k: int, batch_size: int, shards: int = 1) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+    provider = MatrixEmbeddingProvider(vectors)
+    path = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    try:
+        start = time.perf_counter()
+        store = make_store(backend, path, provider, shards)
+        open_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for offset in range(0, size, batch_size):
+            end = min(offset + batch_size, size)
+            texts = [str(i) for i in range(offset, end)]
+            store.add_embeddings([f"doc_{i}" for i in range(offset, end)], texts, vectors[offset:end])
+        ingest_seconds = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            store.query_embedding(query.tolist(), top_k)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+
+        return {
+            "backend": backend,
+            "shards": shards,
+            "size": size,
+            "dim": dim,
+            "open_seconds": open_seconds,
+            "ingest_seconds": ingest_seconds,
+            "ingest_docs_per_second": size / ingest_seconds,
+            "query_p50_ms": float(np.percentile(latencies, 50)),
+            "query_p95_ms": float(np.percentile(latencies, 95)),
+            "query_mean_ms": float(latencies.mean()),
+            "disk_bytes": directory_size(path),
+        }
+    finally:
+        if shards > 1:
+            store.pool.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Chroma and NumPy vector store backends")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma separated corpus sizes")
+    parser.add_argument("--backends", default="chroma,numpy-float32,numpy-float16,numpy-int8",
+                        help="Comma separated backends: chroma, numpy-float32, numpy-float16, numpy-int8")
+    parser.add_argument("--shards", default="1", help="Comma separated shard counts; more than 1 uses shard worker processes")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top_k", type=int, default=20)
+    # Chroma rejects upserts larger than its max batch size (5461 in 0.5.x)
+    parser.add_argument("--batch_size", type=int, default=5000)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    shard_counts = [int(s) for s in args.shards.split(",")]
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for backend, shards in [(backend, shards) for backend in args.backends.split(",") for shards in shard_counts]:
+            result = run(backend, size, args.dim, args.queries, args.top_k, args.batch_size, shards)
+            results.append(result)
+            print(f"{backend:>14} shards={shards:<2} n={size:<8} ingest={result['ingest_docs_per_second']:10.0f} docs/s "
+                  f"p50={result['query_p50_ms']:8.2f}ms p95={result['query_p95_ms']:8.2f}ms "
+                  f"disk={result['disk_bytes'] / 2**20:8.1f}MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import logging
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.pipeline.pipeline import ContextualRAGPipeline
+from src.evaluation.evaluator import Evaluator
+from src.evaluation.stage_cache import StageCache
+
+
+# The dataset is JSON lines: {"query": ..., "answer": ..., "relevant_ids": [chunk ids or file names]}.
+def load_dataset(path: str):
+    queries, answers, relevant = [], [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            queries.append(record["query"])
+            answers.append(record.get("answer", ""))
+            relevant.append(record.get("relevant_ids", []))
+    return queries, answers, relevant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the pipeline on a test set of queries")
+    parser.add_argument("dataset", help="JSON lines file with query, answer and relevant_ids")
+    parser.add_argument("--workers", type=int, default=4, help="Queries evaluated concurrently")
+    parser.add_argument("--cache", default="eval_stage_cache.db",
+                        help="sqlite file caching retrieval and rerank outputs between runs")
+    parser.add_argument("--no_cache", action="store_true", help="Recompute every stage")
+    parser.add_argument("--k", default="1,5,10", help="Comma separated cutoffs for recall@k and nDCG@k")
+    parser.add_argument("--output", default="eval_results.json", help="Where to write the JSON results")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    queries, answers, relevant = load_dataset(args.dataset)
+    cache = None if args.no_cache else StageCache(args.cache)
+    evaluator = Evaluator(ContextualRAGPipeline(), cache=cache, max_workers=args.workers)
+    evaluation = evaluator.evaluate(queries, answers, relevant, k_values=[int(k) for k in args.k.split(",")])
+    with open(args.output, "w") as f:
+        json.dump(evaluation, f, indent=2)
+
+    metrics = evaluation["metrics"]
+    print(f"{len(queries)} queries, {metrics['queries_per_second']:.2f} queries/s, "
+          f"p50={metrics['latency']['p50_ms']:.0f}ms")
+    print(f"exact match {metrics['exact_match']:.3f}, answer F1 {metrics['answer_f1']:.3f}")
+    for stage in ("retrieval", "rerank"):
+        print(f"{stage:>9}: " + ", ".join(f"{name}={value:.3f}" for name, value in metrics[stage].items() if name != "queries"))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
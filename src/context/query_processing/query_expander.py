@@ -2,10 +2,12 @@ from typing import List
 from gensim.models import KeyedVectors
 import nltk
 from nltk.corpus import wordnet
+from ...preprocess.analyzer import TextAnalyzer
 
 class QueryExpander:
-    def __init__(self, word_vectors_path: str):
-        self.word_vectors = KeyedVectors.load_word2vec_format(word_vectors_path, binary=True)
+    def __init__(self, word_vectors_path: str = None):
+        # Without word vectors, expansion falls back to WordNet synonyms only
+        self.word_vectors = KeyedVectors.load_word2vec_format(word_vectors_path, binary=True) if word_vectors_path else None
         # Check if nltk components: wordnet, averaged_perceptron_tagger is already downloaded
         try:
             nltk.data.find('corpus/wordnet')
@@ -20,15 +22,11 @@ class QueryExpander:
         
     
     def expand_query(self, query: str, num_expansions: int = 3) -> List[str]:
-        original_terms = query.lower().split()
+        original_terms = TextAnalyzer.tokenize(query)
         expanded_terms = set[original_terms]
         for term in original_terms:
             # Word embedding based synonym expansion
-            try:
-                similar_words = self.word_vectors.most_similar(term, topn=num_expansions)
-                expanded_terms.update([word for word, _ in similar_words])
-            except KeyError:
-                print(f"Word not found in word vectors: {term}")
+            expanded_terms.update(self._similar_words(term, num_expansions))
             # Thesaurus based synonym expansion
             synonyms = wordnet.synsets(term)
             for synonym in synonyms[:2]: # Avoid over-expansion
@@ -40,7 +38,7 @@ class QueryExpander:
         return expanded_query
 
     def expand_query_with_pos(self,query:str, num_expansions:int=3) -> str:
-        tokens = nltk.word_tokenize(query)
+        tokens = TextAnalyzer.tokenize(query)
         pos_tags = nltk.pos_tag(tokens)
 
         expanded_terms = set(tokens)
@@ -48,11 +46,7 @@ class QueryExpander:
         for term,pos in pos_tags:
             term = term.lower()
             # word embedding based synonym expansion
-            try:
-                similar_words = self.word_vectors.most_similar(term, topn=num_expansions)
-                expanded_terms.update([word for word, _ in similar_words])
-            except KeyError:
-                print(f"Word not found in word vectors: {term}")
+            expanded_terms.update(self._similar_words(term, num_expansions))
             
             # Thesaurus based synonym expansion
             wordnet_pos = self.get_wordnet_pos(pos)
@@ -67,6 +61,15 @@ class QueryExpander:
         return expanded_query
             
    
+    def _similar_words(self, term: str, num_expansions: int) -> List[str]:
+        if self.word_vectors is None:
+            return []
+        try:
+            return [word for word, _ in self.word_vectors.most_similar(term, topn=num_expansions)]
+        except KeyError:
+            print(f"Word not found in word vectors: {term}")
+            return []
+
     @staticmethod
     def get_wordnet_pos(treebank_tag:str) -> str:
         if treebank_tag.startswith('J'):
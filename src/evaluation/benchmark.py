@@ -0,0 +1,200 @@
+import os
+import sys
+import time
+import platform
+import shutil
+import resource
+import tempfile
+import functools
+import tracemalloc
+from typing import Dict, List, Tuple
+import numpy as np
+from config import config
+from .fake_services import FakeServices
+from .metrics import latency_summary
+from ..utils.instrumentation import instrumentation
+
+# Pipeline components timed during a query, as (attribute, method). Timings are inclusive,
+# e.g. vector_search also contains the query embedding call made inside similarity_search.
+QUERY_STAGES = {
+    "query_expansion": ("query_expander", "expand_query_with_pos"),
+    "embedding": ("contextual_embeddings", "generate_embeddings"),
+    "web_search": ("web_search", "search"),
+    "vector_search": ("vector_store", "similarity_search"),
+    "bm25": ("contextual_bm25", "score"),
+    "rerank": ("reranker", "rerank"),
+    "generation": ("answer_generator", "generate_answer"),
+    "context_store": ("context_manager", "add_entry"),
+}
+
+
+# Wraps component methods on a pipeline instance and accumulates wall time per stage.
+class StageTimer:
+    def __init__(self, pipeline, stages: Dict[str, Tuple[str, str]] = QUERY_STAGES):
+        self.current = {}
+        for stage, (attribute, method) in stages.items():
+            component = getattr(pipeline, attribute)
+            setattr(component, method, self._wrap(stage, getattr(component, method)))
+
+    def _wrap(self, stage: str, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.current[stage] = self.current.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+        return timed
+
+    def reset(self) -> Dict[str, float]:
+        timings, self.current = self.current, {}
+        return timings
+
+
+def generate_corpus(num_documents: int, sentences_per_document: int = 20, vocabulary_size: int = 5000,
+                    num_queries: int = 50, seed: int = 0) -> Tuple[List[str], List[str]]:
+    rng = np.random.default_rng(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "do", "gu"]
+    vocabulary = ["".join(rng.choice(syllables, size=rng.integers(2, 5))) for _ in range(vocabulary_size)]
+    # Zipf-like word frequencies so BM25 idf has a realistic spread
+    weights = 1.0 / np.arange(1, vocabulary_size + 1)
+    weights /= weights.sum()
+
+    documents = []
+    for _ in range(num_documents):
+        sentences = []
+        for _ in range(sentences_per_document):
+            words = rng.choice(vocabulary, size=rng.integers(8, 16), p=weights)
+            sentences.append(" ".join(words).capitalize() + ".")
+        documents.append(" ".join(sentences))
+
+    queries = []
+    for _ in range(num_queries):
+        words = documents[rng.integers(num_documents)].rstrip(".").split()
+        start = rng.integers(0, max(1, len(words) - 4))
+        queries.append(" ".join(words[start:start + 4]).lower().replace(".", ""))
+    return documents, queries
+
+
+# With RUSAGE_CHILDREN, the peak of the largest child process that has exited and been waited
+# for, i.e. the biggest shard worker once the pool is closed.
+def _max_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(who).ru_maxrss / scale
+
+
+def run_benchmark(num_documents: int = 100, num_queries: int = 50, sentences_per_document: int = 20,
+                  backend: str = "chroma", embedding_dim: int = 256, embed_latency: float = 0.0,
+                  generate_latency: float = 0.0, generate_latency_per_token: float = 0.0,
+                  search_latency: float = 0.0, model_load_latency: float = 0.0, max_loaded_models: int = None,
+                  trace_memory: bool = False, seed: int = 0, num_shards: int = 1) -> Dict:
+    documents, queries = generate_corpus(num_documents, sentences_per_document, num_queries=num_queries, seed=seed)
+    services = FakeServices(embedding_dim=embedding_dim, embed_latency=embed_latency,
+                            generate_latency=generate_latency,
+                            generate_latency_per_token=generate_latency_per_token,
+                            search_latency=search_latency, model_load_latency=model_load_latency,
+                            max_loaded_models=max_loaded_models).start()
+    workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    previous_cwd = os.getcwd()
+    pipeline = None
+    config.set('OLLAMA', 'HOST', services.url)
+    config.set('API', 'SERPAPI_BACKEND', services.url)
+    config.set('API', 'SERPAPI_API_KEY', 'benchmark')
+    config.set('VECTOR_STORE', 'BACKEND', backend)
+    config.set('VECTOR_STORE', 'PERSIST_DIRECTORY', os.path.join(workdir, 'index'))
+    config.set('SHARDING', 'NUM_SHARDS', num_shards)
+    config.set('SHARDING', 'PERSIST_DIRECTORY', os.path.join(workdir, 'shards'))
+
+    try:
+        # The context history and document manifest databases are created in the working directory
+        os.chdir(workdir)
+        from ..pipeline.pipeline import ContextualRAGPipeline
+        if trace_memory:
+            tracemalloc.start()
+        rss_start = _max_rss_mb()
+        pipeline = ContextualRAGPipeline()
+        instrumentation.reset()
+
+        start = time.perf_counter()
+        for i, text in enumerate(documents):
+            pipeline.add_document(text, {"file_name": f"synthetic_{i}.txt", "file_type": "text"})
+        ingest_seconds = time.perf_counter() - start
+        num_chunks = pipeline.vector_store.count()
+        ingest_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        rss_after_ingest = _max_rss_mb()
+
+        timer = StageTimer(pipeline)
+        totals = []
+        per_stage = {stage: [] for stage in QUERY_STAGES}
+        for query in queries:
+            start = time.perf_counter()
+            pipeline.process_query(query)
+            totals.append((time.perf_counter() - start) * 1000)
+            for stage, elapsed in timer.reset().items():
+                per_stage[stage].append(elapsed)
+        query_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        rss_end = _max_rss_mb()
+        # Shard workers are separate processes; closing the pool reaps them so their peak is reported
+        pipeline.close()
+        pipeline = None
+
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "parameters": {
+                "num_documents": num_documents, "num_queries": num_queries,
+                "sentences_per_document": sentences_per_document, "backend": backend,
+                "embedding_dim": embedding_dim, "embed_latency": embed_latency,
+                "generate_latency": generate_latency, "generate_latency_per_token": generate_latency_per_token,
+                "search_latency": search_latency, "model_load_latency": model_load_latency,
+                "max_loaded_models": max_loaded_models, "seed": seed, "num_shards": num_shards,
+            },
+            "ingestion": {
+                "seconds": ingest_seconds,
+                "documents": num_documents,
+                "chunks": num_chunks,
+                "documents_per_second": num_documents / ingest_seconds,
+                "chunks_per_second": num_chunks / ingest_seconds,
+            },
+            "query_latency": latency_summary(totals),
+            "stage_latency": {stage: latency_summary(samples) for stage, samples in per_stage.items()},
+            "memory": {
+                "max_rss_start_mb": rss_start,
+                "max_rss_after_ingest_mb": rss_after_ingest,
+                "max_rss_end_mb": rss_end,
+                "max_rss_shard_worker_mb": _max_rss_mb(resource.RUSAGE_CHILDREN) if num_shards > 1 else None,
+                "traced_peak_ingest_mb": ingest_peak / 2**20 if ingest_peak is not None else None,
+                "traced_peak_query_mb": query_peak / 2**20 if query_peak is not None else None,
+            },
+            "backend_requests": dict(services.request_counts),
+            "instrumentation": instrumentation.snapshot(),
+        }
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        os.chdir(previous_cwd)
+        services.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Flag stages whose p95 latency, and ingestion whose throughput, got worse than the baseline
+# by more than the tolerance.
+def compare_results(current: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    regressions = []
+    for stage, summary in current["stage_latency"].items():
+        before = baseline.get("stage_latency", {}).get(stage, {}).get("p95_ms")
+        after = summary.get("p95_ms")
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {before:.2f}ms -> {after:.2f}ms")
+    before = baseline.get("query_latency", {}).get("p95_ms")
+    after = current["query_latency"].get("p95_ms")
+    if before and after and after > before * (1 + tolerance):
+        regressions.append(f"query: p95 {before:.2f}ms -> {after:.2f}ms")
+    before = baseline.get("ingestion", {}).get("chunks_per_second")
+    after = current["ingestion"]["chunks_per_second"]
+    if before and after < before * (1 - tolerance):
+        regressions.append(f"ingestion: {before:.1f} -> {after:.1f} chunks/s")
+    return regressions
@@ -1,28 +1,142 @@
-from typing import List, Dict
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Sequence, Tuple
 from ..pipeline.pipeline import ContextualRAGPipeline
+from ..context.context_manager import ContextManager
+from ..preprocess.analyzer import TextAnalyzer
+from .metrics import latency_summary, retrieval_metrics, answer_f1
+from .stage_cache import StageCache
 
+logger = logging.getLogger(__name__)
+
+# Bumped when the shape of a cached retrieval result changes, so older entries are not reused.
+RETRIEVAL_FORMAT = 2
+
+# Runs a test set through the pipeline concurrently. Every query gets its own in-memory context
+# history, so results do not depend on query order and the live history is never touched. The
+# pipeline is shared by the workers: its per-call token counts are kept per thread.
+# Retrieval and rerank outputs are cached per stage (see StageCache): their keys cover the
+# knowledge base and the models and settings each stage depends on, so changing only the
+# generator reuses both, and changing only the reranker reuses retrieval.
+# A query that raises is recorded with its error and scored as a miss with an empty answer, so
+# one failure does not discard the rest of the run.
 class Evaluator:
-    def __init__(self, pipeline: ContextualRAGPipeline):
+    def __init__(self, pipeline: ContextualRAGPipeline, cache: StageCache = None, max_workers: int = 4):
         self.pipeline = pipeline
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def _retrieval_key(self, query: str, knowledge_base: str, settings: Dict) -> str:
+        return StageCache.make_key(query, knowledge_base, settings, RETRIEVAL_FORMAT)
+
+    def _rerank_key(self, retrieval_key: str) -> str:
+        reranker = self.pipeline.reranker
+        return StageCache.make_key(retrieval_key, reranker.model, reranker.prompt_budget.max_tokens, reranker.context_share)
+
+    def _run_query(self, query: str, knowledge_base: str, settings: Dict) -> Dict:
+        start = time.perf_counter()
+        try:
+            response = self._answer_query(query, knowledge_base, settings)
+        except Exception as e:
+            logger.error("Evaluation query %r failed: %s", query, e)
+            response = {"answer": "", "sources": [], "usage": {}, "retrieved_ids": [], "reranked_ids": [],
+                        "error": f"{type(e).__name__}: {e}"}
+        response["latency_ms"] = (time.perf_counter() - start) * 1000
+        return response
+
+    def _answer_query(self, query: str, knowledge_base: str, settings: Dict) -> Dict:
+        pipeline = self.pipeline
+        context_manager = ContextManager(db_path=':memory:')
+        try:
+            retrieval_key = self._retrieval_key(query, knowledge_base, settings)
+            if self.cache is not None:
+                retrieval = self.cache.get_or_compute("retrieval", retrieval_key,
+                                                      lambda: pipeline.retrieve(query, context_manager))
+            else:
+                retrieval = pipeline.retrieve(query, context_manager)
+            if not retrieval["results"]:
+                return {"answer": "", "sources": [], "usage": {}, "retrieved_ids": [], "reranked_ids": []}
+
+            usage = {"rerank_prompt_tokens": None}
+
+            def rerank():
+                reranked = pipeline.rerank(query, retrieval["results"])
+                usage["rerank_prompt_tokens"] = sum(count or 0 for count in pipeline.reranker.prompt_token_counts)
+                return reranked
+
+            if self.cache is not None:
+                reranked = self.cache.get_or_compute("rerank", self._rerank_key(retrieval_key), rerank)
+            else:
+                reranked = rerank()
+            answer = pipeline.answer_generator.generate_answer(query, retrieval["history"], reranked[:3])
+            usage.update(pipeline.answer_generator.last_usage)
+        finally:
+            context_manager.close()
+        return {
+            "answer": answer,
+            "sources": reranked[:5],
+            "usage": usage,
+            "retrieved_ids": [result["id"] for result in retrieval["results"] if result.get("is_local")],
+            "reranked_ids": [result["id"] for result in reranked if result.get("is_local")],
+        }
+
+    # Relevant ids may be chunk ids or file names. A judgement that names a file is scored at file
+    # level: the ranking is collapsed to files, keeping each file's first hit, and any chunk ids in
+    # the judgement stand for their file. Judgements of chunk ids only are scored on chunks.
+    def _judged_rankings(self, rankings: List[List[str]], relevant_ids: List[Sequence[str]]) -> Tuple[List[List[str]], List[set]]:
+        manifest = self.pipeline.document_manifest
+        documents = set(manifest.list_documents())
+        chunk_ids = list({doc_id for ids in list(rankings) + list(relevant_ids) for doc_id in ids or []} - documents)
+        file_of = manifest.get_file_names(chunk_ids)
+
+        judged_rankings, judged_relevant = [], []
+        for ranking, relevant in zip(rankings, relevant_ids):
+            relevant = relevant or []
+            if any(doc_id in documents for doc_id in relevant):
+                ranking = list(dict.fromkeys(file_of.get(doc_id, doc_id) for doc_id in ranking))
+                relevant = {file_of.get(doc_id, doc_id) for doc_id in relevant}
+            judged_rankings.append(ranking)
+            judged_relevant.append(set(relevant))
+        return judged_rankings, judged_relevant
+
+    def evaluate(self, test_queries: List[str], ground_truth: List[str], relevant_ids: List[Sequence[str]] = None,
+                 k_values: Sequence[int] = (1, 5, 10)) -> Dict:
+        knowledge_base = self.pipeline.document_manifest.fingerprint()
+        settings = self.pipeline.retrieval_settings()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = list(executor.map(lambda query: self._run_query(query, knowledge_base, settings), test_queries))
+        elapsed = time.perf_counter() - start
 
-    def evaluate(self, test_queries: List[str], ground_truth: List[str]) -> Dict:
         results = []
-        for query, truth in zip(test_queries, ground_truth):
-            response = self.pipeline.process_query(query)
-            results.append({
+        for query, truth, response in zip(test_queries, ground_truth, responses):
+            result = {
                 "query": query,
                 "ground_truth": truth,
                 "generated_answer": response["answer"],
-                "sources": response["sources"]
-            })
-        
-        # Implement your evaluation metrics here
-        # For example, you could use BLEU score, ROUGE, or custom metrics
+                "sources": response["sources"],
+                "usage": response["usage"],
+            }
+            if "error" in response:
+                result["error"] = response["error"]
+            results.append(result)
+
+        answers = [TextAnalyzer.tokenize(response["answer"]) for response in responses]
+        truths = [TextAnalyzer.tokenize(truth) for truth in ground_truth]
+        metrics = {
+            "exact_match": sum(answer == truth for answer, truth in zip(answers, truths)) / max(len(truths), 1),
+            "answer_f1": sum(answer_f1(answer, truth) for answer, truth in zip(answers, truths)) / max(len(truths), 1),
+            "latency": latency_summary([response["latency_ms"] for response in responses]),
+            "queries_per_second": len(test_queries) / elapsed if elapsed > 0 else 0.0,
+            "failed_queries": sum("error" in response for response in responses),
+        }
+        if relevant_ids is not None:
+            for stage, field in (("retrieval", "retrieved_ids"), ("rerank", "reranked_ids")):
+                rankings, relevant = self._judged_rankings([r[field] for r in responses], relevant_ids)
+                metrics[stage] = retrieval_metrics(rankings, relevant, k_values)
 
         return {
             "results": results,
-            "metrics": {
-                "accuracy": 0.0,  # Placeholder for actual metric
-                "relevance": 0.0  # Placeholder for actual metric
-            }
-        }
\ No newline at end of file
+            "metrics": metrics
+        }
@@ -0,0 +1,190 @@
+import re
+import json
+import time
+import zlib
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+# Local stand-ins for the Ollama embeddings/generate endpoints and the SerpAPI search
+# endpoint, with configurable latency, so the pipeline can be benchmarked offline.
+# Model residency is simulated too: a request for a model that is not loaded pays
+# model_load_latency, and at most max_loaded_models stay loaded (least recently used
+# is evicted), like Ollama on a memory-constrained host.
+class FakeServices:
+    def __init__(self, embedding_dim: int = 256, embed_latency: float = 0.0, generate_latency: float = 0.0,
+                 generate_latency_per_token: float = 0.0, search_latency: float = 0.0, num_search_results: int = 3,
+                 model_load_latency: float = 0.0, max_loaded_models: int = None, embed_latency_per_item: float = 0.0,
+                 ollama_parallel: int = None):
+        self.embedding_dim = embedding_dim
+        self.embed_latency = embed_latency
+        # Extra cost per input of a batched /api/embed request, on top of embed_latency per request
+        self.embed_latency_per_item = embed_latency_per_item
+        self.generate_latency = generate_latency
+        self.generate_latency_per_token = generate_latency_per_token
+        self.search_latency = search_latency
+        self.num_search_results = num_search_results
+        self.model_load_latency = model_load_latency
+        self.max_loaded_models = max_loaded_models
+        self.loaded_models = OrderedDict()
+        self.request_counts = {"embeddings": 0, "embed": 0, "generate": 0, "search": 0, "model_loads": 0}
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        # Like OLLAMA_NUM_PARALLEL: at most this many Ollama requests are processed at once
+        self._ollama_slots = threading.Semaphore(ollama_parallel) if ollama_parallel else contextlib.nullcontext()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeServices":
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/api/embeddings":
+                    self._send(services.embeddings(body))
+                elif self.path == "/api/embed":
+                    self._send(services.embed(body))
+                elif self.path == "/api/generate":
+                    self._send(services.generate(body))
+                else:
+                    self._send({"error": f"unknown endpoint {self.path}"}, status=404)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/search":
+                    self._send(services.search({k: v[0] for k, v in parse_qs(url.query).items()}))
+                else:
+                    self._send({"error": f"unknown endpoint {url.path}"}, status=404)
+
+            def _send(self, payload: Dict, status: int = 200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # The default backlog of 5 drops connections under concurrent benchmark load
+            request_queue_size = 128
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.request_counts[endpoint] += 1
+
+    # Returns the load duration in nanoseconds, as Ollama reports it. keep_alive=0 unloads after use.
+    def _use_model(self, model: str, keep_alive=None) -> int:
+        with self._model_lock:
+            start = time.perf_counter()
+            if model in self.loaded_models:
+                self.loaded_models.move_to_end(model)
+            else:
+                self._count("model_loads")
+                time.sleep(self.model_load_latency)
+                self.loaded_models[model] = True
+                while self.max_loaded_models and len(self.loaded_models) > self.max_loaded_models:
+                    self.loaded_models.popitem(last=False)
+            if keep_alive in (0, "0", "0s"):
+                self.loaded_models.pop(model, None)
+            return int((time.perf_counter() - start) * 1e9)
+
+    # Hashed bag of words: texts sharing words get similar vectors, so retrieval stays meaningful.
+    def embed_text(self, text: str) -> List[float]:
+        vector = np.zeros(self.embedding_dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.embedding_dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vector.tolist()
+
+    def embeddings(self, body: Dict) -> Dict:
+        self._count("embeddings")
+        with self._ollama_slots:
+            self._use_model(body.get("model"), body.get("keep_alive"))
+            time.sleep(self.embed_latency)
+        return {"embedding": self.embed_text(body.get("prompt", ""))}
+
+    # Batched endpoint; like Ollama's /api/embed it returns L2-normalised vectors.
+    def embed(self, body: Dict) -> Dict:
+        self._count("embed")
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        with self._ollama_slots:
+            load_duration = self._use_model(body.get("model"), body.get("keep_alive"))
+            time.sleep(self.embed_latency + self.embed_latency_per_item * len(inputs))
+        embeddings = []
+        for text in inputs:
+            vector = np.asarray(self.embed_text(text))
+            norm = np.linalg.norm(vector)
+            embeddings.append((vector / norm if norm > 0 else vector).tolist())
+        return {"model": body.get("model"), "embeddings": embeddings, "load_duration": load_duration}
+
+    def generate(self, body: Dict) -> Dict:
+        self._count("generate")
+        prompt = body.get("prompt", "")
+        with self._ollama_slots:
+            load_duration = self._use_model(body.get("model"), body.get("keep_alive"))
+            # An empty prompt only loads the model
+            if not prompt:
+                return {"model": body.get("model"), "response": "", "done": True, "load_duration": load_duration}
+            prompt_tokens = len(re.findall(r"\w+|[^\w\s]", prompt))
+            time.sleep(self.generate_latency + self.generate_latency_per_token * prompt_tokens)
+        if "Rate the relevance" in prompt:
+            response = str(zlib.crc32(prompt.encode("utf-8")) % 11)
+        else:
+            response = "This is a synthetic answer produced by the benchmark stand-in."
+        return {
+            "model": body.get("model"),
+            "response": response,
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": len(response.split()),
+            "load_duration": load_duration,
+        }
+
+    def search(self, params: Dict) -> Dict:
+        self._count("search")
+        time.sleep(self.search_latency)
+        query = params.get("q", "")
+        return {
+            "organic_results": [
+                {
+                    "title": f"Result {i + 1} for {query}",
+                    "snippet": f"Web snippet {i + 1} discussing {query} in some detail.",
+                    "link": f"https://example.com/{i + 1}",
+                }
+                for i in range(self.num_search_results)
+            ]
+        }
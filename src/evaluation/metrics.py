@@ -0,0 +1,76 @@
+from collections import Counter
+from typing import Dict, List, Sequence, Set
+import numpy as np
+
+
+def latency_summary(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {"count": 0}
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    p50, p90, p95, p99 = np.percentile(samples, [50, 90, 95, 99])
+    return {
+        "count": int(samples.size),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(samples.max()),
+    }
+
+
+# Boolean (queries x k) matrix: hits[q, i] is True when the i-th ranked id of query q is relevant.
+# Rankings shorter than k are padded with misses.
+def relevance_matrix(ranked_ids: List[List[str]], relevant_ids: List[Set[str]], k: int) -> np.ndarray:
+    hits = np.zeros((len(ranked_ids), k), dtype=bool)
+    for q, (ranking, relevant) in enumerate(zip(ranked_ids, relevant_ids)):
+        flags = [doc_id in relevant for doc_id in ranking[:k]]
+        hits[q, :len(flags)] = flags
+    return hits
+
+
+def recall_at_k(hits: np.ndarray, num_relevant: np.ndarray, k: int) -> np.ndarray:
+    return hits[:, :k].sum(axis=1) / np.maximum(num_relevant, 1)
+
+
+# Reciprocal rank of the first relevant result, 0 when none is retrieved.
+def reciprocal_rank(hits: np.ndarray) -> np.ndarray:
+    first = hits.argmax(axis=1)
+    return np.where(hits.any(axis=1), 1.0 / (first + 1), 0.0)
+
+
+# Binary-relevance nDCG: DCG over the top k divided by the DCG of an ideal ranking.
+def ndcg_at_k(hits: np.ndarray, num_relevant: np.ndarray, k: int) -> np.ndarray:
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits[:, :k] @ discounts
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(num_relevant, k)]
+    return np.divide(dcg, ideal, out=np.zeros_like(dcg), where=ideal > 0)
+
+
+# Mean recall@k, MRR and nDCG@k over a whole run. Queries without any relevant ids are left out.
+def retrieval_metrics(ranked_ids: List[List[str]], relevant_ids: List[Set[str]],
+                      k_values: Sequence[int] = (1, 5, 10)) -> Dict[str, float]:
+    judged = [i for i, relevant in enumerate(relevant_ids) if relevant]
+    if not judged:
+        return {"queries": 0}
+    ranked_ids = [ranked_ids[i] for i in judged]
+    relevant_ids = [set(relevant_ids[i]) for i in judged]
+    max_k = max(max(k_values), max(len(ranking) for ranking in ranked_ids))
+    hits = relevance_matrix(ranked_ids, relevant_ids, max_k)
+    num_relevant = np.array([len(relevant) for relevant in relevant_ids])
+    metrics = {"queries": len(judged), "mrr": float(reciprocal_rank(hits).mean())}
+    for k in k_values:
+        metrics[f"recall@{k}"] = float(recall_at_k(hits, num_relevant, k).mean())
+        metrics[f"ndcg@{k}"] = float(ndcg_at_k(hits, num_relevant, k).mean())
+    return metrics
+
+
+# SQuAD-style answer overlap on analyzed tokens.
+def answer_f1(prediction_tokens: List[str], truth_tokens: List[str]) -> float:
+    common = Counter(prediction_tokens) & Counter(truth_tokens)
+    overlap = sum(common.values())
+    if not overlap:
+        return 0.0
+    precision = overlap / len(prediction_tokens)
+    recall = overlap / len(truth_tokens)
+    return 2 * precision * recall / (precision + recall)
@@ -0,0 +1,67 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional
+from ..utils.instrumentation import instrumentation
+
+
+# Caches the output of a pipeline stage (retrieval, rerank) keyed by a hash of everything the
+# stage depends on, so an evaluation run after a generator-only change reuses earlier stages.
+# Values are stored as JSON in sqlite, which makes the cache safe to share between runs.
+class StageCache:
+    def __init__(self, db_path: str = 'eval_stage_cache.db'):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.create_table()
+
+    def create_table(self):
+        with self.conn:
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS stage_cache (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (stage, key)
+            )
+            ''')
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM stage_cache WHERE stage = ? AND key = ?', (stage, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, stage: str, key: str, value: Any):
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO stage_cache (stage, key, value) VALUES (?, ?, ?)',
+                              (stage, key, json.dumps(value)))
+
+    def get_or_compute(self, stage: str, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(stage, key)
+        labels = {"cache": f"eval_{stage}"}
+        if value is not None:
+            instrumentation.increment("cache.hits", labels=labels)
+            return value
+        instrumentation.increment("cache.misses", labels=labels)
+        value = compute()
+        self.put(stage, key, value)
+        return value
+
+    def clear(self, stage: str = None):
+        with self._lock, self.conn:
+            if stage is None:
+                self.conn.execute('DELETE FROM stage_cache')
+            else:
+                self.conn.execute('DELETE FROM stage_cache WHERE stage = ?', (stage,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.conn.execute('SELECT stage, COUNT(*) FROM stage_cache GROUP BY stage').fetchall())
+
+    def close(self):
+        self.conn.close()
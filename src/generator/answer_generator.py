@@ -1,23 +1,53 @@
-import ollama
+import logging
+import threading
 from typing import List, Dict
+from .prompt_budget import PromptBudget, HistoryEntry
+from .model_residency import ModelResidencyManager
+from ..utils.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
 
 class AnswerGenerator:
-    def __init__(self, model_name: str = "llama3"):
+    def __init__(self, model_name: str = "llama3", max_prompt_tokens: int = 2048, host: str = None,
+                 residency: ModelResidencyManager = None):
         self.model = model_name
+        self.residency = residency or ModelResidencyManager(host=host)
+        self.prompt_budget = PromptBudget(max_tokens=max_prompt_tokens)
+        self._local = threading.local()
+
+    # Token usage of the last answer generated on this thread (see Reranker.prompt_token_counts).
+    @property
+    def last_usage(self) -> Dict:
+        return getattr(self._local, "last_usage", {})
+
+    @last_usage.setter
+    def last_usage(self, usage: Dict):
+        self._local.last_usage = usage
+
+    def generate_answer(self, query: str, history: List[HistoryEntry], reranked_results: List[Dict]) -> str:
+        prompt = self._construct_prompt(query, history, reranked_results)
+        estimated_tokens = self.prompt_budget.count_tokens(prompt)
 
-    def generate_answer(self, query: str, context: str, reranked_results: List[Dict]) -> str:
-        prompt = self._construct_prompt(query, context, reranked_results)
-        
+        labels = {"model": self.model, "role": "generator"}
+        self.last_usage = {}
         try:
-            response = ollama.generate(model=self.model, prompt=prompt)            
+            response = self.residency.generate(self.model, prompt, labels)
+            self.last_usage = {
+                "estimated_prompt_tokens": estimated_tokens,
+                "prompt_tokens": response.get('prompt_eval_count'),
+                "completion_tokens": response.get('eval_count'),
+            }
+            instrumentation.increment("llm.calls", labels=labels)
+            instrumentation.increment("llm.prompt_tokens", self.last_usage['prompt_tokens'] or 0, labels)
+            instrumentation.increment("llm.completion_tokens", self.last_usage['completion_tokens'] or 0, labels)
+            logger.debug("Answer prompt tokens: %s (estimated %d, budget %d)",
+                         self.last_usage['prompt_tokens'], estimated_tokens, self.prompt_budget.max_tokens)
             return response['response'].strip()
         except Exception as e:
             print(f"Error generating answer: {e}")
             return "I apologize, but I encountered an error while generating the answer."
 
-    def _construct_prompt(self, query: str, context: str, reranked_results: List[Dict]) -> str:
-        sources = "\n".join([f"Source {i+1}: {result['text']}" for i, result in enumerate(reranked_results)])
-        
+    def _format_prompt(self, query: str, context: str, sources: str) -> str:
         prompt = f"""
         Query: {query}
 
@@ -26,11 +56,24 @@ class AnswerGenerator:
         Relevant Sources:
         {sources}
 
-        Based on the query, context, and relevant sources provided, please generate a comprehensive and accurate answer. 
-        Ensure that your response directly addresses the query and incorporates information from the given sources. 
+        Based on the query, context, and relevant sources provided, please generate a comprehensive and accurate answer.
+        Ensure that your response directly addresses the query and incorporates information from the given sources.
         If the sources contain conflicting information, please mention this and provide a balanced view.
 
         Answer:
         """
-        
-        return prompt
\ No newline at end of file
+
+        return prompt
+
+    # Fit history and sources into what the budget leaves after the fixed instructions and the query.
+    # History gets at most its configured share; sources get the rest, highest ranked first.
+    def _construct_prompt(self, query: str, history: List[HistoryEntry], reranked_results: List[Dict]) -> str:
+        budget = self.prompt_budget
+        available = budget.max_tokens - budget.count_tokens(self._format_prompt(query, "", ""))
+        source_labels = budget.count_tokens("Source 1: \n") * len(reranked_results)
+
+        context = budget.fit_history(history, int((available - source_labels) * budget.history_share))
+        source_texts = budget.fit_sources(reranked_results, available - source_labels - budget.count_tokens(context))
+        sources = "\n".join([f"Source {i+1}: {text}" for i, text in enumerate(source_texts)])
+
+        return self._format_prompt(query, context, sources)
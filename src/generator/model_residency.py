@@ -0,0 +1,58 @@
+import time
+import logging
+import threading
+from typing import Dict, List
+import ollama
+from ..utils.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+# Every Ollama call goes through one manager so that models are loaded once at startup, kept
+# resident with an explicit keep_alive, and every load or model switch shows up in the metrics.
+# On a host that can only hold one model, each switch between models means an unload/reload.
+class ModelResidencyManager:
+    def __init__(self, host: str = None, keep_alive: str = "30m"):
+        self.client = ollama.Client(host=host)
+        self.keep_alive = keep_alive
+        self.last_model = None
+        self._lock = threading.Lock()
+
+    # Track the sequence of models used; a change of model is a potential swap on the Ollama host.
+    def record_use(self, model: str):
+        with self._lock:
+            swapped = self.last_model is not None and self.last_model != model
+            self.last_model = model
+        if swapped:
+            instrumentation.increment("ollama.model_switches", labels={"model": model})
+
+    def _record_load(self, model: str, response) -> float:
+        load_ms = (response.get('load_duration') or 0) / 1e6
+        instrumentation.observe("ollama.model_load", load_ms, {"model": model})
+        return load_ms
+
+    def generate(self, model: str, prompt: str, labels: Dict[str, str] = None):
+        self.record_use(model)
+        with instrumentation.span("ollama.generate", labels or {"model": model}):
+            response = self.client.generate(model=model, prompt=prompt, keep_alive=self.keep_alive)
+        self._record_load(model, response)
+        return response
+
+    # An empty prompt (or, for embedding models, which cannot generate, an empty /api/embed
+    # input) makes Ollama load the model and return immediately.
+    def warm(self, models: List[str], embedding_models: List[str] = ()) -> Dict[str, float]:
+        load_times = {}
+        for model in dict.fromkeys(list(embedding_models) + list(models)):
+            start = time.perf_counter()
+            try:
+                if model in embedding_models:
+                    response = self.client.embed(model=model, input=[], keep_alive=self.keep_alive)
+                else:
+                    response = self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            except Exception as e:
+                logger.warning("Could not warm model %s: %s", model, e)
+                continue
+            self.record_use(model)
+            load_times[model] = self._record_load(model, response)
+            logger.debug("Warmed %s in %.0fms (load %.0fms)", model, (time.perf_counter() - start) * 1000, load_times[model])
+        return load_times
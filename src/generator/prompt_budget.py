@@ -0,0 +1,85 @@
+import re
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Word pieces and individual punctuation marks, roughly what a BPE tokenizer splits on.
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# One turn of the weighted context history: (relevance score, query, answer). The current query
+# is the last entry and has no answer.
+HistoryEntry = Tuple[float, str, Optional[str]]
+
+
+def format_history_entry(score: float, query: str, answer: Optional[str] = None) -> str:
+    return f"{score:.2f} * Q: {query}" + (f" A: {answer}" if answer is not None else "")
+
+
+def format_history(entries: Sequence[HistoryEntry]) -> str:
+    return " | ".join(format_history_entry(*entry) for entry in entries)
+
+
+# Keeps prompts under a fixed token budget. Token counts are estimated locally (one token per
+# four characters of each word piece, at least one per piece), which tracks llama-family
+# tokenizers closely enough to bound prefill cost without a round trip to Ollama.
+class PromptBudget:
+    def __init__(self, max_tokens: int = 2048, history_share: float = 0.25, chars_per_token: int = 4):
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.chars_per_token = chars_per_token
+
+    def _piece_tokens(self, piece: str) -> int:
+        return max(1, math.ceil(len(piece) / self.chars_per_token))
+
+    def count_tokens(self, text: str) -> int:
+        return sum(self._piece_tokens(match.group()) for match in TOKEN_PATTERN.finditer(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        # Leave room for the "..." marker (three tokens) that flags the cut
+        if max_tokens <= 3:
+            return ""
+        used = 0
+        for match in TOKEN_PATTERN.finditer(text):
+            used += self._piece_tokens(match.group())
+            if used > max_tokens - 3:
+                return text[:match.start()].rstrip() + " ..."
+        return text
+
+    # The history produced by ContextualRAGPipeline.generate_context ends with the current query.
+    # The current query is always kept; earlier turns are kept in order of relevance score until
+    # the budget runs out, and are formatted in their original order.
+    def fit_history(self, entries: Sequence[HistoryEntry], max_tokens: int) -> str:
+        context = format_history(entries)
+        if not entries or self.count_tokens(context) <= max_tokens:
+            return context
+        current, history = format_history_entry(*entries[-1]), entries[:-1]
+        remaining = max_tokens - self.count_tokens(current)
+
+        kept = {}
+        for i in sorted(range(len(history)), key=lambda i: history[i][0], reverse=True):
+            if remaining <= 0:
+                break
+            # One extra token for the " | " separator
+            segment = self.truncate(format_history_entry(*history[i]), remaining - 1)
+            if not segment:
+                break
+            remaining -= self.count_tokens(segment) + 1
+            kept[i] = segment
+        return " | ".join([kept[i] for i in sorted(kept)] + [self.truncate(current, max(max_tokens, 1))])
+
+    # Sources arrive ranked by relevance. Each gets at most an equal share of the budget, with
+    # whatever a short source leaves unused passed on to the ones after it.
+    def fit_sources(self, results: List[Dict], max_tokens: int) -> List[str]:
+        texts = []
+        remaining = max_tokens
+        for i, result in enumerate(results):
+            if remaining <= 0:
+                break
+            share = remaining // (len(results) - i)
+            text = self.truncate(result['text'], share)
+            remaining -= self.count_tokens(text)
+            texts.append(text)
+        return texts
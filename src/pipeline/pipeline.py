@@ -1,35 +1,209 @@
-from typing import List, Dict, Tuple
+import os
+import logging
+from typing import List, Dict, Optional, Tuple
 import numpy as np
 from ..context.context_manager import ContextManager
 from ..utils.text_chunker import TextChunker
-from ..retriever.contextual_embeddings import ContextualEmbeddings, OllamaEmbeddings
+from ..retriever.contextual_embeddings import ContextualEmbeddings, OllamaEmbeddings, CoalescingEmbeddingProvider
 from ..retriever.contextual_bm25 import ContextualBM25
+from ..preprocess.analyzer import TextAnalyzer
 from ..search.web_search import WebSearch
 from ..reranker.reranker_base import Reranker
 from ..retriever.vector_store import VectorStore
+from ..retriever.numpy_vector_store import NumpyVectorStore
+from ..retriever.document_manifest import DocumentManifest
+from ..retriever.snapshot import write_snapshot, validate_snapshot, restore_snapshot
+from ..retriever.sharding import ShardPool, ShardedVectorStore, ShardedBM25
 from ..generator.answer_generator import AnswerGenerator
+from ..generator.prompt_budget import HistoryEntry, format_history
+from ..generator.model_residency import ModelResidencyManager
 from ..context.query_processing.query_expander import QueryExpander
+from ..utils.instrumentation import instrumentation, configure as configure_instrumentation
+from config import config
+
+logger = logging.getLogger(__name__)
 
 class ContextualRAGPipeline:
     def __init__(self):        
-        ollama_provider = OllamaEmbeddings(model_name="llama3.1")
+        configure_instrumentation(config)
+        ollama_host = config.get('OLLAMA', 'HOST', fallback=None)
+        embedding_model = config.get('MODELS', 'EMBEDDING_MODEL', fallback='llama3.1')
+        generator_model = config.get('MODELS', 'GENERATOR_MODEL', fallback='llama3.1')
+        # The reranker shares the generator's model unless configured otherwise, so one resident model serves both
+        reranker_model = config.get('MODELS', 'RERANKER_MODEL', fallback=generator_model)
+        self.model_residency = ModelResidencyManager(host=ollama_host, keep_alive=config.get('MODELS', 'KEEP_ALIVE', fallback='30m'))
+
+        batching = config.get('BATCHING', 'ENABLED', fallback='false').lower() == 'true'
+        # Coalescing only pays off when a batch goes out as one request, so batching implies /api/embed
+        batch_endpoint = config.get('BATCHING', 'EMBED_BATCH_ENDPOINT', fallback=str(batching)).lower() == 'true'
+        if batching and not batch_endpoint:
+            logger.warning("[BATCHING] is enabled with EMBED_BATCH_ENDPOINT = false; batches are sent one text per request")
+        self.embed_batch_endpoint = batch_endpoint
+        ollama_provider = OllamaEmbeddings(model_name=embedding_model, host=ollama_host, residency=self.model_residency,
+                                           batch_endpoint=batch_endpoint)
+        if batching:
+            ollama_provider = CoalescingEmbeddingProvider(
+                ollama_provider,
+                max_batch_size=int(config.get('BATCHING', 'MAX_BATCH_SIZE', fallback=32)),
+                max_wait_ms=float(config.get('BATCHING', 'MAX_WAIT_MS', fallback=5)),
+            )
         self.contextual_embeddings = ContextualEmbeddings(provider=ollama_provider)
-        self.contextual_bm25 = ContextualBM25()
+        self.shard_pool = self.create_shard_pool()
+        self.document_manifest = DocumentManifest()
+        self.text_analyzer = self.create_text_analyzer(self.document_manifest.get_terms())
+        self.contextual_bm25 = self.load_bm25_index()
         self.web_search = WebSearch()
-        self.reranker = Reranker()
-        self.vector_store = VectorStore(persist_directory="./chroma_db", embedding_provider=self.contextual_embeddings)
-        self.answer_generator = AnswerGenerator(model_name="llama3.1")
+        self.reranker = Reranker(model_name=reranker_model, max_prompt_tokens=int(config.get('PROMPT', 'RERANK_MAX_PROMPT_TOKENS', fallback=512)), residency=self.model_residency)
+        self.vector_store = self.create_vector_store()
+        self.index_layout_error = self.check_index_layout()
+        self.answer_generator = AnswerGenerator(model_name=generator_model, max_prompt_tokens=int(config.get('PROMPT', 'MAX_PROMPT_TOKENS', fallback=2048)), residency=self.model_residency)
         self.text_chunker = TextChunker()
-        self.query_expander = QueryExpander()
+        self.query_expander = QueryExpander(config.get('QUERY_EXPANSION', 'WORD_VECTORS_PATH', fallback=None))
 
+        self.embedding_model = embedding_model
         self.context_manager = ContextManager()
         self.context_window_size = 5
+        self.retrieval_top_k = 20
+
+    # Load every model a query uses, so the first query does not pay the load time. Not done in
+    # __init__: knowledge-base maintenance commands never call a model and should not wait for one.
+    def warm_models(self) -> Dict[str, float]:
+        return self.model_residency.warm([self.reranker.model, self.answer_generator.model],
+                                         embedding_models=[self.embedding_model])
+
+    # With more than one shard, or remote shard addresses, the vector and lexical indexes are
+    # partitioned across shard worker processes and every query is scattered to all of them.
+    def create_shard_pool(self):
+        num_shards = int(config.get('SHARDING', 'NUM_SHARDS', fallback=1))
+        addresses = [a.strip() for a in config.get('SHARDING', 'ADDRESSES', fallback='').split(',') if a.strip()]
+        if num_shards <= 1 and not addresses:
+            return None
+        authkey = config.get('SHARDING', 'AUTHKEY', fallback=None)
+        return ShardPool(
+            num_shards=num_shards,
+            backend=config.get('VECTOR_STORE', 'BACKEND', fallback='chroma').lower(),
+            persist_directory=config.get('SHARDING', 'PERSIST_DIRECTORY', fallback='./shards'),
+            dtype=config.get('VECTOR_STORE', 'DTYPE', fallback='float32'),
+            addresses=addresses,
+            authkey=authkey.encode('utf-8') if authkey else None,
+        )
+
+    @property
+    def num_shards(self) -> int:
+        return self.shard_pool.num_shards if self.shard_pool is not None else 1
+
+    # Where the vector index lives: the shard addresses or directory when sharded, else the backend's directory.
+    def index_location(self) -> str:
+        if self.shard_pool is not None:
+            addresses = config.get('SHARDING', 'ADDRESSES', fallback='').replace(' ', '')
+            return addresses or os.path.abspath(config.get('SHARDING', 'PERSIST_DIRECTORY', fallback='./shards'))
+        return os.path.abspath(self.vector_store_directory())
+
+    def vector_store_directory(self) -> str:
+        backend = config.get('VECTOR_STORE', 'BACKEND', fallback='chroma').lower()
+        default = './numpy_index' if backend == 'numpy' else './chroma_db'
+        return config.get('VECTOR_STORE', 'PERSIST_DIRECTORY', fallback=default)
+
+    # The settings the manifest's chunks are tied to. Chunks are placed by shard_for(id, num_shards)
+    # and live in one backend and location, so the manifest only describes that index.
+    def index_layout(self) -> Dict[str, str]:
+        return {
+            "num_shards": str(self.num_shards),
+            "backend": config.get('VECTOR_STORE', 'BACKEND', fallback='chroma').lower(),
+            "index_location": self.index_location(),
+            **self.analyzer_settings(),
+        }
+
+    def record_index_layout(self):
+        for key, value in self.index_layout().items():
+            self.document_manifest.set_setting(key, value)
+        self.index_layout_error = None
+
+    # Compare the layout recorded in the manifest with the configured one. Returns an error message
+    # on a mismatch; commands that use the index refuse to run then, while clear and restore, which
+    # rebuild it, record the new layout. Manifests from before a setting was recorded adopt the
+    # current value, unless they list documents that the configured index does not hold at all.
+    def check_index_layout(self) -> Optional[str]:
+        layout = self.index_layout()
+        documents = self.document_manifest.list_documents()
+        if documents:
+            changed = {key: built for key in layout
+                       if (built := self.document_manifest.get_setting(key)) is not None and built != layout[key]}
+            if changed:
+                differences = ", ".join(f"{key} {built} (now {layout[key]})" for key, built in changed.items())
+                if changed.keys() & self.analyzer_settings().keys():
+                    return (f"The knowledge base was built with {differences}. The stored term ids depend on the "
+                            f"analyzer: restore those settings, or --clear_kb and re-ingest.")
+                return (f"The knowledge base was built with {differences}. Restore those settings, or move the "
+                        f"knowledge base over with --snapshot under the old settings and --restore under the new ones.")
+            if not self.vector_store.count():
+                return (f"The document manifest lists {len(documents)} document(s), but the vector index at "
+                        f"{layout['index_location']} is empty. Restore the settings it was built with, or --clear_kb "
+                        f"and re-ingest.")
+        self.record_index_layout()
+        return None
+
+    def _require_index_layout(self):
+        if self.index_layout_error:
+            raise RuntimeError(self.index_layout_error)
+
+    # Select the vector index backend from configuration: "chroma" (default) or "numpy".
+    def create_vector_store(self):
+        if self.shard_pool is not None:
+            return ShardedVectorStore(self.shard_pool, embedding_provider=self.contextual_embeddings)
+        backend = config.get('VECTOR_STORE', 'BACKEND', fallback='chroma').lower()
+        if backend == 'numpy':
+            return NumpyVectorStore(
+                persist_directory=self.vector_store_directory(),
+                embedding_provider=self.contextual_embeddings,
+                dtype=config.get('VECTOR_STORE', 'DTYPE', fallback='float32'),
+            )
+        if backend != 'chroma':
+            raise ValueError(f"Unknown vector store backend: {backend}")
+        return VectorStore(
+            persist_directory=self.vector_store_directory(),
+            embedding_provider=self.contextual_embeddings,
+        )
+
+    # One analysis chain for lexical indexing and scoring; the vocabulary persists in the manifest.
+    # The analyzer options the stored term ids depend on, as "true"/"false" for the manifest settings.
+    def analyzer_settings(self) -> Dict[str, str]:
+        return {
+            key: 'true' if config.get('ANALYZER', key.upper(), fallback='false').lower() == 'true' else 'false'
+            for key in ("stem", "remove_stopwords")
+        }
+
+    def create_text_analyzer(self, vocabulary: List[str] = ()) -> TextAnalyzer:
+        settings = self.analyzer_settings()
+        return TextAnalyzer(
+            stem=settings["stem"] == 'true',
+            remove_stopwords=settings["remove_stopwords"] == 'true',
+            vocabulary=vocabulary,
+        )
+
+    def create_bm25_index(self) -> ContextualBM25:
+        if self.shard_pool is not None:
+            return ShardedBM25(self.shard_pool, analyzer=self.text_analyzer)
+        return ContextualBM25(analyzer=self.text_analyzer)
 
-    def generate_context(self,query:str) -> str:
+    # Rebuild the BM25 index from the term id arrays stored with each chunk in the manifest.
+    def load_bm25_index(self) -> ContextualBM25:
+        bm25 = self.create_bm25_index()
+        ids, term_arrays = [], []
+        for chunk_id, terms in self.document_manifest.iter_chunk_term_ids():
+            ids.append(chunk_id)
+            term_arrays.append(terms)
+        if ids:
+            bm25.add_term_ids(ids, term_arrays)
+        return bm25
+
+    # The weighted history as (score, query, answer) entries ending with the current query; the
+    # answer generator fits these to its budget, and format_history renders them for retrieval.
+    def generate_context(self,query:str, context_manager: ContextManager = None) -> List[HistoryEntry]:
         query_embedding = self.contextual_embeddings.generate_embeddings([query], "")[0]
             
         # Get recent contexts
-        recent_contexts = self.context_manager.get_recent_contexts(self.context_window_size - 1)
+        recent_contexts = (context_manager or self.context_manager).get_recent_contexts(self.context_window_size - 1)
         
         # Calculate relevance scores
         relevance_scores = self.calculate_relevance_scores(query_embedding, [emb for _, _, emb in recent_contexts])
@@ -51,78 +225,207 @@ class ContextualRAGPipeline:
         weighted_similarities = np.array(similarities) * recent_weights
         return list(weighted_similarities / np.sum(weighted_similarities)) if weighted_similarities.size>  0 else []
 
-    def generate_weighted_context(self, current_query: str, relevance_scores: List[float], recent_contexts: List[Tuple[str, str, List[float]]]) -> str:
+    def generate_weighted_context(self, current_query: str, relevance_scores: List[float], recent_contexts: List[Tuple[str, str, List[float]]]) -> List[HistoryEntry]:
         # Combine historical queries and responses based on their relevance scores
         weighted_contexts = [
-            f"{score:.2f} * Q: {query} A: {response}"
+            (float(score), query, response)
             for score, (query, response, _) in zip(relevance_scores, recent_contexts)
         ]
         
         # Add the current query with full weight
-        weighted_contexts.append(f"1.00 * Q: {current_query}")
+        weighted_contexts.append((1.0, current_query, None))
         
-        return " | ".join(weighted_contexts)
+        return weighted_contexts
 
 
-    def add_document_chunk(self, chunk: str, metadata: Dict):
-        try:
-             # Generate a context summary from the metadata
-            context = f"Title: {metadata.get('title', 'Unknown')}\n"
-            context += f"Author: {metadata.get('author', 'Unknown')}\n"
-            context += f"Subject: {metadata.get('subject', 'Unknown')}\n"
-            context += f"Chunk {metadata.get('chunk_index', 0)} of {metadata.get('total_chunks', 1)}\n"
-
-           # embedding = self.contextual_embeddings.generate_embeddings([chunk], context)[0]
-                   
-            #if not embedding:
-             #   print("Error: No embedding generated to add document. The embedding service might be unavailable.")
-            #    return False
-            # add more metadata 
-            chunk_metadata =  metadata.copy()
-            chunk_metadata["content_summary"] = chunk[:100] #placeholder for now
-            chunk_metadata["is_chunk"] = True
-            chunk_metadata["chunk_index"] = metadata.get("chunk_index", 0) 
-
-            # Generate a unique ID for the chunk
-            chunk_id = f"doc_{metadata.get('file_name', 'unknown')}_{metadata.get('chunk_index', 0)}"
-             # Check if the document already exists
-            existing_doc = self.vector_store.get_document_by_id(chunk_id)
-            print(f"DEBUG: existing_doc: {existing_doc}")
-            if existing_doc['ids']:
-                print(f"Document with ID {chunk_id} already exists. Updating...")
-                self.vector_store.update_document(chunk_id, chunk, chunk_metadata)
-            else:
-                print(f"DEBUG: Adding new document with ID {chunk_id}")
-                self.vector_store.add_documents([chunk], [chunk_metadata], [chunk_metadata], [chunk_id])
+    def build_chunk_metadata(self, chunk: str, metadata: Dict) -> Dict:
+        chunk_metadata = metadata.copy()
+        chunk_metadata["content_summary"] = chunk[:100] #placeholder for now
+        chunk_metadata["is_chunk"] = True
+        chunk_metadata["chunk_index"] = metadata.get("chunk_index", 0)
+        return chunk_metadata
 
-            self.contextual_bm25.add_documents([chunk])
-            return True
-        except Exception as e:
-            print(f"Error adding document chunk: {e}")
-            return False
+    # Chunks ingested before the manifest existed used positional ids: doc_{file_name}_{index}.
+    def _legacy_chunk_ids(self, file_name: str) -> List[str]:
+        first_chunk = self.vector_store.get_document_by_id(f"doc_{file_name}_0")
+        if not first_chunk['ids']:
+            return []
+        total_chunks = (first_chunk['metadatas'][0] or {}).get('total_chunks', 1)
+        return [f"doc_{file_name}_{i}" for i in range(total_chunks)]
 
-            self.vector_store.add_documents([text], [embedding], metadata)
+    # Re-ingest a document incrementally: only chunks whose content hash is new get embedded,
+    # unchanged chunks just have their metadata refreshed, and chunks that no longer exist are
+    # removed from both the vector store and the BM25 index.
+    # source records where the document came from (a synced directory), so that pruning one
+    # source never removes documents that were uploaded or synced from elsewhere.
+    def add_document(self, text: str,metadata, source: str = None):
+        self._require_index_layout()
+        file_name = metadata.get('file_name', 'unknown')
+        document_hash = self.document_manifest.hash_document(text, metadata)
+        previous_hash = self.document_manifest.get_document_hash(file_name)
+        previous_source = self.document_manifest.get_document_source(file_name)
+        if previous_hash is not None and previous_source != source:
+            logger.warning("%s from %s replaces the document of the same name from %s",
+                           file_name, source or "an upload", previous_source or "an upload")
+        if previous_hash == document_hash:
+            if previous_source != source:
+                self.document_manifest.set_document_source(file_name, source)
+            logger.info("%s is unchanged, skipping re-ingestion", file_name)
+            instrumentation.increment("cache.hits", labels={"cache": "documents"})
+            return True
+        instrumentation.increment("cache.misses", labels={"cache": "documents"})
 
-    def add_document(self, text: str,metadata):
         chunks = self.text_chunker.chunk_text(text)
-        success = True
-        for i, chunk in enumerate(chunks):
+        chunk_entries = self.document_manifest.chunk_ids(file_name, chunks)
+        term_arrays = [self.text_analyzer.term_ids(chunk) for chunk in chunks]
+        previous_chunks = self.document_manifest.get_chunks(file_name)
+        if not previous_chunks:
+            previous_chunks = dict.fromkeys(self._legacy_chunk_ids(file_name))
+
+        new_ids, new_texts, new_metadatas, new_terms = [], [], [], []
+        kept_ids, kept_metadatas, kept_terms = [], [], []
+        for i, (chunk, (chunk_id, _), terms) in enumerate(zip(chunks, chunk_entries, term_arrays)):
             chunk_metadata = metadata.copy()
             chunk_metadata["chunk_index"] = i
             chunk_metadata["total_chunks"] = len(chunks)
-            if not self.add_document_chunk(chunk, chunk_metadata):
-                success = False
-        return success
+            chunk_metadata = self.build_chunk_metadata(chunk, chunk_metadata)
+            if chunk_id in previous_chunks:
+                kept_ids.append(chunk_id)
+                kept_metadatas.append(chunk_metadata)
+                kept_terms.append(terms)
+            else:
+                new_ids.append(chunk_id)
+                new_texts.append(chunk)
+                new_metadatas.append(chunk_metadata)
+                new_terms.append(terms)
+        kept = set(kept_ids)
+        stale_ids = [chunk_id for chunk_id in previous_chunks if chunk_id not in kept]
+
+        instrumentation.increment("cache.hits", len(kept_ids), labels={"cache": "chunk_embeddings"})
+        instrumentation.increment("cache.misses", len(new_ids), labels={"cache": "chunk_embeddings"})
+        try:
+            if new_ids:
+                self.vector_store.add_documents(new_texts, new_metadatas, new_ids)
+                self.contextual_bm25.add_term_ids(new_ids, new_terms)
+            if kept_ids:
+                self.vector_store.update_metadata(kept_ids, kept_metadatas)
+                # Chunks ingested before term ids were stored are missing from the lexical index
+                unindexed = set(self.contextual_bm25.missing_ids(kept_ids))
+                if unindexed:
+                    positions = [i for i, chunk_id in enumerate(kept_ids) if chunk_id in unindexed]
+                    self.contextual_bm25.add_term_ids([kept_ids[i] for i in positions], [kept_terms[i] for i in positions])
+            if stale_ids:
+                self.vector_store.remove_documents(stale_ids)
+                self.contextual_bm25.remove_documents(stale_ids)
+            self.document_manifest.save_terms(self.text_analyzer.terms)
+            self.document_manifest.save_document(file_name, document_hash, chunk_entries, term_arrays, source)
+        except Exception as e:
+            logger.error("Error adding document %s: %s", file_name, e)
+            return False
+        logger.info("%s: %d chunks embedded, %d unchanged, %d removed", file_name, len(new_ids), len(kept_ids), len(stale_ids))
+        return True
+
+    def remove_document(self, file_name: str) -> bool:
+        self._require_index_layout()
+        chunk_ids = list(self.document_manifest.get_chunks(file_name))
+        if not chunk_ids:
+            return False
+        self.vector_store.remove_documents(chunk_ids)
+        self.contextual_bm25.remove_documents(chunk_ids)
+        self.document_manifest.remove_document(file_name)
+        return True
+
+    def clear_knowledge_base(self):
+        self.vector_store.clear_database()
+        self.document_manifest.clear()
+        self.record_index_layout()
+        self.text_analyzer = self.create_text_analyzer()
+        self.contextual_bm25 = self.create_bm25_index()
+
+    def create_snapshot(self, path: str) -> Dict:
+        self._require_index_layout()
+        return write_snapshot(self.vector_store, self.document_manifest, path, embedding_model=self.embedding_model)
+
+    # Replace the knowledge base with a snapshot: vectors are bulk-loaded as stored, and the lexical
+    # index is rebuilt from the term ids in the snapshot's manifest, so nothing is re-embedded.
+    # The snapshot is validated before anything is cleared, so a bad one leaves the knowledge base intact.
+    def restore_snapshot(self, path: str) -> Dict:
+        validate_snapshot(path, embedding_model=self.embedding_model, settings=self.analyzer_settings())
+        self.clear_knowledge_base()
+        info = restore_snapshot(self.vector_store, self.document_manifest, path, embedding_model=self.embedding_model,
+                                settings=self.analyzer_settings())
+        # The snapshot's manifest carries the layout it was taken from; the chunks now follow this one
+        self.record_index_layout()
+        self.text_analyzer = self.create_text_analyzer(self.document_manifest.get_terms())
+        self.contextual_bm25 = self.load_bm25_index()
+        return info
 
-    def process_query(self, query: str) -> Dict:
-        expanded_query = self.query_expander.expand_query_with_pos(query)
-        context = self.generate_context(expanded_query)
-        print(f"DEBUG: Context: {context}")
+    # context_manager defaults to the pipeline's own history; pass another one, e.g. an in-memory
+    # ContextManager, to run a query without reading or writing the shared context history.
+    def process_query(self, query: str, context_manager: ContextManager = None) -> Dict:
+        with instrumentation.span("query"):
+            result = self._process_query(query, context_manager or self.context_manager)
+        instrumentation.export()
+        return result
+
+    def _process_query(self, query: str, context_manager: ContextManager) -> Dict:
+        retrieval = self.retrieve(query, context_manager)
+        if not retrieval["results"]:
+            return {
+                "answer": "I'm sorry, but I couldn't find any relevant information to answer your query.",
+                "sources": [],
+                "web_texts": retrieval["web_texts"]
+            }
+        # Step 6: Rerank results
+        reranked_results = self.rerank(query, retrieval["results"])
+
+        # Step 7: Generate answer
+        with instrumentation.span("query.generate"):
+            answer = self.answer_generator.generate_answer(query, retrieval["history"], reranked_results[:3])
+
+        # step 8 : store the query and answer in the context manager
+        with instrumentation.span("query.store_context"):
+            context_manager.add_entry(query, answer, retrieval["query_embedding"])
+
+
+        return {
+            "answer": answer,
+            "sources": reranked_results[:5]
+        }
+
+    # Every setting retrieve() depends on besides the query and the knowledge base, for keying cached
+    # retrieval results. Whole config sections are included so that new options are covered too.
+    def retrieval_settings(self) -> Dict:
+        return {
+            "embedding_model": self.embedding_model,
+            "embed_batch_endpoint": self.embed_batch_endpoint,
+            "vector_store": config.section('VECTOR_STORE'),
+            "sharding": {key: value for key, value in config.section('SHARDING').items() if key != 'authkey'},
+            "num_shards": self.num_shards,
+            "query_expansion": config.section('QUERY_EXPANSION'),
+            "analyzer": {"stem": self.text_analyzer.stem, "remove_stopwords": self.text_analyzer.remove_stopwords},
+            "bm25": {"k1": self.contextual_bm25.k1, "b": self.contextual_bm25.b},
+            "top_k": self.retrieval_top_k,
+            "context_window_size": self.context_window_size,
+            "web_search_backend": self.web_search.backend,
+        }
+
+    # Everything up to reranking. The result only holds JSON-serialisable values, so it can be cached.
+    def retrieve(self, query: str, context_manager: ContextManager = None) -> Dict:
+        self._require_index_layout()
+        context_manager = context_manager or self.context_manager
+        with instrumentation.span("query.expansion"):
+            expanded_query = self.query_expander.expand_query_with_pos(query)
+        with instrumentation.span("query.context"):
+            history = self.generate_context(expanded_query, context_manager)
+            context = format_history(history)
+        logger.debug("Context: %s", context)
 
         
         
         # Step 1: Perform web search
-        web_results = self.web_search.search(query)        
+        with instrumentation.span("query.web_search"):
+            web_results = self.web_search.search(query)
         web_texts = []
         for result in web_results:
             if 'description' in result:
@@ -135,27 +438,28 @@ class ContextualRAGPipeline:
                 print(f"Warning: 'snippet' or 'body' or 'title' not found in web result: {result}")
 
         # Step 2: Retrieve relevant local documents
-        # query_embedding = self.contextual_embeddings.generate_embeddings([query], "")[0]
-
-       
-        local_results = self.vector_store.similarity_search(query, context, top_k=20)
-        local_texts = local_results['documents'][0] if local_results['ids'][0] else []
-        local_scores = local_results['distances'][0] if local_results['ids'][0] else []
+        with instrumentation.span("query.vector_search"):
+            local_results = self.vector_store.similarity_search(query, context, top_k=self.retrieval_top_k)
+        # Embed the query for the context history now, while the embedding model is resident,
+        # rather than after generation when it would force a switch back from the generator model.
+        with instrumentation.span("query.history_embedding"):
+            query_embedding = self.contextual_embeddings.generate_embeddings([query], "")[0]
+        local_ids = [result.get('id') for result in local_results]
+        local_texts = [result['text'] for result in local_results]
+        local_scores = [result['score'] for result in local_results]
        
       
-        # Step 3: Combine local and web results and initialize scores
+        # Step 3: Combine local and web results
         all_texts = local_texts + web_texts
+        retrieval = {"context": context, "history": history, "query_embedding": list(map(float, query_embedding)),
+                     "web_texts": web_texts, "results": []}
         if not all_texts:
-            return {
-                "answer": "I'm sorry, but I couldn't find any relevant information to answer your query.",
-                "sources": [],
-                "web_texts": web_texts
-            }
-        all_scores = local_scores + [0] * len(web_results)  # Initialize web scores to 0
+            return retrieval
 
-        # Step 4: Perform contextual BM25 scoring on all texts
-        self.contextual_bm25.add_documents(all_texts)
-        bm25_scores = self.contextual_bm25.score(query, context)
+        # Step 4: Perform contextual BM25 scoring on all texts. Local chunks are scored from their
+        # stored term ids; web results are not indexed and are analyzed on the fly.
+        with instrumentation.span("query.bm25"):
+            bm25_scores = self.contextual_bm25.score(query, context, ids=local_ids + [None] * len(web_texts), texts=all_texts)
 
         def normalize(scores):
             min_score = min(scores)
@@ -167,7 +471,6 @@ class ContextualRAGPipeline:
 
 
         # Step 5: Normalize Combine vector similarity and BM25 scores
-        combined_results = []
         for i, (text, vector_score, bm25_score) in enumerate(zip(all_texts, vector_scores, bm25_scores)):
             combined_score = (vector_score + bm25_score) / 2
             result = {
@@ -176,24 +479,28 @@ class ContextualRAGPipeline:
                 "combined_score": combined_score,
                 "is_local": i < len(local_texts)
             }
-            if not result["is_local"]:
+            if result["is_local"]:
+                result["id"] = local_ids[i]
+            else:
                 result.update(web_results[i - len(local_texts)])
-            combined_results.append(result)       
-        # Step 6: Rerank results
-        # print(f"DEBUG: Combined results structure: {combined_results[:2]}")  # Print first two items for brevity
-        reranked_results = self.reranker.rerank(query, " ".join(all_texts), combined_results)
+            retrieval["results"].append(result)
+        return retrieval
 
-        # Step 7: Generate answer
-        answer = self.answer_generator.generate_answer(query, context, reranked_results[:3])
-
-        # step 8 : store the query and answer in the context manager
-        query_embedding = self.contextual_embeddings.generate_embeddings([query], "")[0]
-        self.context_manager.add_entry(query, answer, query_embedding)
+    def rerank(self, query: str, results: List[Dict]) -> List[Dict]:
+        with instrumentation.span("query.rerank"):
+            return self.reranker.rerank(query, " ".join(result["text"] for result in results), results)
 
+    # Release the shard workers, the embedding batcher and the index and history databases, e.g.
+    # before removing the directory they live in.
+    def close(self):
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+        if hasattr(self.contextual_embeddings.provider, "close"):
+            self.contextual_embeddings.provider.close()
+        if hasattr(self.vector_store, "close"):
+            self.vector_store.close()
+        self.document_manifest.close()
+        self.context_manager.close()
 
-        return {
-            "answer": answer,
-            "sources": reranked_results[:5]
-        }
     def __del__(self):
-        self.context_manager.close()
+        self.close()
@@ -0,0 +1,70 @@
+import re
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional
+from nltk.stem import PorterStemmer
+
+# Common English function words; kept inline so the analyzer needs no NLTK corpus download.
+ENGLISH_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can did do does doing down during each few for from further had has have having
+he her here hers herself him himself his how i if in into is it its itself just me more most my myself
+no nor not now of off on once only or other our ours ourselves out over own same she should so some
+such than that the their theirs them themselves then there these they this those through to too under
+until up very was we were what when where which while who whom why will with you your yours yourself
+yourselves
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+# The one text-analysis chain shared by lexical indexing, lexical scoring and query expansion:
+# Unicode normalisation, case folding, punctuation stripping, and optionally stopword removal
+# and Porter stemming. Terms are mapped to integer ids from a growing vocabulary so each chunk
+# can be stored as a compact array('I') of term ids instead of a list of Python strings.
+class TextAnalyzer:
+    def __init__(self, stem: bool = False, remove_stopwords: bool = False, vocabulary: Iterable[str] = ()):
+        self.stem = stem
+        self.remove_stopwords = remove_stopwords
+        self.stemmer = PorterStemmer() if stem else None
+        self._stems = {}
+        self.terms: List[str] = []
+        self.vocabulary: Dict[str, int] = {}
+        for term in vocabulary:
+            self.add_term(term)
+
+    # Normalised surface tokens, without stemming or stopword removal; WordNet needs real words.
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).casefold())
+
+    def analyze(self, text: str) -> List[str]:
+        tokens = self.tokenize(text)
+        if self.remove_stopwords:
+            tokens = [token for token in tokens if token not in ENGLISH_STOPWORDS]
+        if self.stemmer:
+            tokens = [self._stem(token) for token in tokens]
+        return tokens
+
+    def _stem(self, token: str) -> str:
+        stem = self._stems.get(token)
+        if stem is None:
+            stem = self._stems[token] = self.stemmer.stem(token)
+        return stem
+
+    def add_term(self, term: str) -> int:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            term_id = self.vocabulary[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def term_id(self, term: str) -> Optional[int]:
+        return self.vocabulary.get(term)
+
+    # Encode text as term ids. New terms are added to the vocabulary, so use this at ingest time only.
+    def term_ids(self, text: str) -> array:
+        return array('I', [self.add_term(term) for term in self.analyze(text)])
+
+    def decode(self, term_ids: Iterable[int]) -> str:
+        return " ".join(self.terms[term_id] for term_id in term_ids)
@@ -1,27 +1,52 @@
 from typing import List, Dict
-import ollama
 from ollama._types import ResponseError
 import re
+import logging
+import threading
+from ..generator.prompt_budget import PromptBudget
+from ..generator.model_residency import ModelResidencyManager
+from ..utils.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
 
 class Reranker:
-    def __init__(self, model_name: str = "llama2"):
+    def __init__(self, model_name: str = "llama2", max_prompt_tokens: int = 512, context_share: float = 0.3, host: str = None,
+                 residency: ModelResidencyManager = None):
         self.model = model_name
+        self.residency = residency or ModelResidencyManager(host=host)
+        self.prompt_budget = PromptBudget(max_tokens=max_prompt_tokens)
+        self.context_share = context_share
+        self._local = threading.local()
+
+    # Prompt tokens of each call made by the last rerank on this thread. Kept per thread so
+    # concurrent queries sharing one Reranker each see their own counts.
+    @property
+    def prompt_token_counts(self) -> List:
+        return getattr(self._local, "prompt_token_counts", [])
+
+    @prompt_token_counts.setter
+    def prompt_token_counts(self, counts: List):
+        self._local.prompt_token_counts = counts
 
     def rerank(self, query: str, context: str, results: List[Dict]) -> List[Dict]:
         reranked_results = []
+        self.prompt_token_counts = []
+        # The context is shared by every per-document prompt, so fit it to the budget once.
+        budget = self.prompt_budget
+        available = budget.max_tokens - budget.count_tokens(self._format_prompt(query, "", ""))
+        context = budget.truncate(context, int(available * self.context_share))
+        document_tokens = available - budget.count_tokens(context)
+        labels = {"model": self.model, "role": "reranker"}
         for i, result in enumerate(results):
-            prompt = f"""
-            Query: {query}
-            Context: {context}
-            Document: {result['text'][:500]}  # Limit document text to 500 characters
-
-            Rate the relevance of this document to the query and context on a scale of 0 to 10, where 0 is completely irrelevant and 10 is highly relevant.
-            Only respond with a number between 0 and 10. DO NOT include any other text. ONLY THE SCORE.  NO extra explanation. OUTPUT a number.
-            """
+            prompt = self._format_prompt(query, context, budget.truncate(result['text'], document_tokens))
             try:
-                response = ollama.generate(model=self.model, prompt=prompt)
+                response = self.residency.generate(self.model, prompt, labels)
+                self.prompt_token_counts.append(response.get('prompt_eval_count'))
+                instrumentation.increment("llm.calls", labels=labels)
+                instrumentation.increment("llm.prompt_tokens", response.get('prompt_eval_count') or 0, labels)
+                instrumentation.increment("llm.completion_tokens", response.get('eval_count') or 0, labels)
                 response_text = response['response'].strip()
-                print(f"DEBUG: Raw model response for result {i}: {response_text}")
+                logger.debug("Raw model response for result %d: %s", i, response_text)
 
                 # Try to extract a number from the response
                 match = re.search(r'\b(\d+(?:\.\d+)?)\b', response_text)
@@ -42,5 +67,17 @@ class Reranker:
                 print(f"Unexpected error when processing result {i}: {e}")
                 result['relevance_score'] = 5  # Assign a neutral score
                 reranked_results.append(result)
-        
+
+        logger.debug("Rerank prompt tokens: %d over %d calls (budget %d per call)",
+                     sum(count or 0 for count in self.prompt_token_counts), len(self.prompt_token_counts), budget.max_tokens)
         return sorted(reranked_results, key=lambda x: x['relevance_score'], reverse=True)
+
+    def _format_prompt(self, query: str, context: str, document: str) -> str:
+        return f"""
+            Query: {query}
+            Context: {context}
+            Document: {document}
+
+            Rate the relevance of this document to the query and context on a scale of 0 to 10, where 0 is completely irrelevant and 10 is highly relevant.
+            Only respond with a number between 0 and 10. DO NOT include any other text. ONLY THE SCORE.  NO extra explanation. OUTPUT a number.
+            """
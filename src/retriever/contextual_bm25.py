@@ -1,86 +1,185 @@
 import math
-from typing import List
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from ..preprocess.analyzer import TextAnalyzer
 
 
+# Documents are stored as arrays of integer term ids produced by the shared TextAnalyzer at
+# ingest time, so scoring never re-tokenizes stored text. Document frequencies are kept
+# incrementally in an array indexed by term id.
 class ContextualBM25:
-    def __init__(self, k1: float = 1.5, b: float = 0.75):
+    def __init__(self, k1: float = 1.5, b: float = 0.75, analyzer: TextAnalyzer = None):
         self.k1 = k1
         self.b = b
-        self.corpus = []
-        self.doc_lengths = []
+        self.analyzer = analyzer or TextAnalyzer()
+        self.corpus: List[array] = []
+        self.doc_ids = []
+        self.doc_lengths = array('I')
+        self.doc_freqs = array('I')
         self.avg_doc_length = 0
-        self.idf = {}
+        self._positions: Dict[str, int] = {}
 
-    def add_documents(self, documents: List[str]):
-        new_docs = [doc.split() for doc in documents if doc.strip()]  # Skip empty documents
+    def add_documents(self, documents: List[str], ids: List[str] = None):
+        if ids is None:
+            ids = [None] * len(documents)
+        self.add_term_ids(ids, [self.analyzer.term_ids(doc) for doc in documents])
+
+    # Add documents that were already encoded with this index's analyzer, e.g. loaded from the manifest.
+    def add_term_ids(self, ids: List[Optional[str]], term_arrays: Iterable[array]):
+        new_docs = [(doc_id, terms) for doc_id, terms in zip(ids, term_arrays) if len(terms)]  # Skip empty documents
         if not new_docs:
             print("Warning: No valid documents to add.")
             return
 
-        self.corpus.extend(new_docs)
-        self.doc_lengths.extend(len(doc) for doc in new_docs)
-        
+        for doc_id, terms in new_docs:
+            if doc_id is not None:
+                self._positions[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.corpus.append(terms)
+            self.doc_lengths.append(len(terms))
+            self._count_terms(terms, 1)
+        self._update_avg_doc_length()
+
+    # Drop documents by id and update corpus statistics for what remains.
+    def remove_documents(self, ids: List[str]):
+        stale = set(ids)
+        keep = [i for i, doc_id in enumerate(self.doc_ids) if doc_id not in stale]
+        if len(keep) == len(self.doc_ids):
+            return
+        for i, doc_id in enumerate(self.doc_ids):
+            if doc_id in stale:
+                self._count_terms(self.corpus[i], -1)
+        self.doc_ids = [self.doc_ids[i] for i in keep]
+        self.corpus = [self.corpus[i] for i in keep]
+        self.doc_lengths = array('I', [self.doc_lengths[i] for i in keep])
+        self._positions = {doc_id: i for i, doc_id in enumerate(self.doc_ids) if doc_id is not None}
+        self._update_avg_doc_length()
+
+    def missing_ids(self, ids: List[str]) -> List[str]:
+        return [doc_id for doc_id in ids if doc_id not in self._positions]
+
+    def get_term_ids(self, doc_id: str) -> Optional[array]:
+        position = self._positions.get(doc_id)
+        return self.corpus[position] if position is not None else None
+
+    def _count_terms(self, terms: array, delta: int):
+        unique_terms = set(terms)
+        if unique_terms:
+            missing = max(unique_terms) + 1 - len(self.doc_freqs)
+            if missing > 0:
+                self.doc_freqs.extend(array('I', [0]) * missing)
+        for term_id in unique_terms:
+            self.doc_freqs[term_id] += delta
+
+    def _update_avg_doc_length(self):
         if self.corpus:
             self.avg_doc_length = sum(self.doc_lengths) / len(self.corpus)
         else:
             self.avg_doc_length = 0
 
-        self._calculate_idf()
+    @staticmethod
+    def _idf(df: int, num_docs: int) -> float:
+        return math.log((num_docs - df + 0.5) / (df + 0.5) + 1)
 
-    # Calculate IDF for each term in the corpus. IDF is the inverse document frequency of a term, 
-    # which measures how important the term is in the corpus. 
-    def _calculate_idf(self):
-        if not self.corpus:
-            print("Warning:Corpus is empty. Unbale to calculate IDF")
-            return
-        N = len(self.corpus)
-        for doc in self.corpus:
-            for term in set(doc):
-                if term not in self.idf:
-                    df = sum(1 for doc in self.corpus if term in doc) # calculate document frequency
-                    self.idf[term] = math.log(N - df + 0.5) / (df + 0.5) +1
-
-    # Calculate the score of a query for a given context. 
+    def _doc_freq(self, term_id: Optional[int]) -> int:
+        return self.doc_freqs[term_id] if term_id is not None and term_id < len(self.doc_freqs) else 0
+
+    # IDF is the inverse document frequency of a term, which measures how important the term is in the corpus.
+    def idf(self, term_id: Optional[int]) -> float:
+        return self._idf(self._doc_freq(term_id), len(self.corpus))
+
+    # Query terms as (term, term id) pairs; terms outside the vocabulary have no id and can
+    # only match texts that are scored without being indexed, such as web results.
+    def query_terms(self, query: str):
+        return [(term, self.analyzer.term_id(term)) for term in self.analyzer.analyze(query)]
+
+    def context_boosts(self, context: str, query_terms) -> Dict[str, float]:
+        context_counts = Counter(self.analyzer.analyze(context))
+        total = sum(context_counts.values())
+        return {term: 1 + (context_counts[term] / total if total else 0) for term, _ in query_terms}
+
+    # Corpus statistics for the given term ids. Shards report these so that candidates from
+    # several partial indexes can be scored as if they came from one corpus.
+    def statistics(self, term_ids: List[Optional[int]]) -> Dict:
+        return {
+            "num_docs": len(self.corpus),
+            "total_length": sum(self.doc_lengths),
+            "doc_freqs": [self._doc_freq(term_id) for term_id in term_ids],
+        }
+
+    # (document length, term frequency of each query term) for the given indexed ids; unknown ids are left out.
+    def term_frequencies(self, ids: List[str], term_ids: List[Optional[int]]) -> Dict[str, tuple]:
+        frequencies = {}
+        for doc_id in ids:
+            position = self._positions.get(doc_id)
+            if position is not None:
+                frequencies[doc_id] = self._indexed_frequencies(position, term_ids)
+        return frequencies
+
+    def _indexed_frequencies(self, position: int, term_ids: List[Optional[int]]) -> tuple:
+        terms = self.corpus[position]
+        return self.doc_lengths[position], [terms.count(term_id) if term_id is not None else 0 for term_id in term_ids]
+
+    def text_frequencies(self, text: str, query_terms) -> tuple:
+        counts = Counter(self.analyzer.analyze(text))
+        return sum(counts.values()), [counts[term] for term, _ in query_terms]
+
+    # Calculate the score of a query for a given context.
     # See https://www.elastic.co/blog/practical-bm25-part-2-the-score-function
-    def score(self, query: str, context: str) -> List[float]:
-        query_terms = query.split()
-        context_terms = context.split()
+    def score_frequencies(self, query_terms, boosts: Dict[str, float], frequencies: List[tuple], statistics: Dict) -> List[float]:
+        num_docs = statistics["num_docs"]
+        avg_doc_length = statistics["total_length"] / num_docs if num_docs else 0
+        idfs = [self._idf(df, num_docs) for df in statistics["doc_freqs"]]
         scores = []
-        for i, doc in enumerate(self.corpus):
+        for doc_length, tfs in frequencies:
+            length_norm = 1 - self.b + self.b * (doc_length / avg_doc_length if avg_doc_length else 1)
             score = 0
-            for term in query_terms:
-                if term in doc:
-                    tf = doc.count(term)
-                    context_boost = 1 + (context_terms.count(term) / len(context_terms))
-                    numerator = self.idf[term] * tf * (self.k1 + 1) * context_boost
-                    denominator = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_doc_length)                    
+            for (term, _), idf, tf in zip(query_terms, idfs, tfs):
+                if tf:
+                    numerator = idf * tf * (self.k1 + 1) * boosts[term]
+                    denominator = tf + self.k1 * length_norm
                     score += numerator / denominator
             scores.append(score)
         return scores
-                    
 
-    def search(self,query:str, context:str, top_k:int=5) -> List[str]:
-        query_terms = query.lower().split()
-        context_terms = context.lower().split()
-        scores = []
-        for i, doc in enumerate(self.corpus):
-            score = 0
-            for term in query_terms:
-                if term in doc:
-                    tf = doc.count(term)
-                    context_boost = 1 + (context_terms.count(term) / len(context_terms))
-                    numerator = self.idf[term] * tf * (self.k1 + 1) * context_boost
-                    denominator = tf + self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_doc_length)                    
-                    score += numerator / denominator
-            scores.append((i,score))
+    # Without ids or texts every indexed document is scored. Otherwise each candidate is scored
+    # from its stored term ids when its id is indexed, and from its text when it is not.
+    def score(self, query: str, context: str, ids: List[Optional[str]] = None, texts: List[str] = None) -> List[float]:
+        query_terms = self.query_terms(query)
+        term_ids = [term_id for _, term_id in query_terms]
+        boosts = self.context_boosts(context, query_terms)
+        if ids is None and texts is None:
+            frequencies = [self._indexed_frequencies(i, term_ids) for i in range(len(self.corpus))]
+        else:
+            ids = ids if ids is not None else [None] * len(texts)
+            frequencies = []
+            for i, doc_id in enumerate(ids):
+                position = self._positions.get(doc_id) if doc_id is not None else None
+                if position is not None:
+                    frequencies.append(self._indexed_frequencies(position, term_ids))
+                else:
+                    frequencies.append(self.text_frequencies(texts[i], query_terms))
+        return self.score_frequencies(query_terms, boosts, frequencies, self.statistics(term_ids))
+
+    # The top_k indexed documents as (id, score, term ids), scored under the given corpus
+    # statistics; a shard passes the statistics of the whole knowledge base.
+    def top_documents(self, query_terms, boosts: Dict[str, float], statistics: Dict, top_k: int) -> List[tuple]:
+        term_ids = [term_id for _, term_id in query_terms]
+        frequencies = [self._indexed_frequencies(i, term_ids) for i in range(len(self.corpus))]
+        scores = self.score_frequencies(query_terms, boosts, frequencies, statistics)
         # sort the scores in desc and get top k results
-        top_k_results = sorted(scores, key=lambda x: x[1], reverse=True)[:top_k]
-        results = []
-        for doc_id, score in top_k_results:
-            results.append({"text": " ".join(self.corpus[doc_id]), "score": score})
-        return results
-    
+        top_k_results = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_k]
+        return [(self.doc_ids[i], score, self.corpus[i]) for i, score in top_k_results]
+
+    def search(self, query: str, context: str, top_k: int = 5) -> List[Dict]:
+        query_terms = self.query_terms(query)
+        boosts = self.context_boosts(context, query_terms)
+        statistics = self.statistics([term_id for _, term_id in query_terms])
+        return [
+            {"id": doc_id, "text": self.analyzer.decode(terms), "score": score}
+            for doc_id, score, terms in self.top_documents(query_terms, boosts, statistics, top_k)
+        ]
 
     def generate_embeddings(self, texts: List[str], context: str) -> List[list[float]]:
         pass
-
@@ -2,6 +2,8 @@ from typing import List, Dict
 import requests
 import logging
 from abc import ABC, abstractmethod
+from ..utils.instrumentation import instrumentation
+from ..utils.batching import MicroBatcher
 
 
 class EmbeddingProvider(ABC):
@@ -10,22 +12,46 @@ class EmbeddingProvider(ABC):
         pass
 
 class OllamaEmbeddings(EmbeddingProvider):
-    def __init__(self, model_name: str = "llama3.1"):
+    def __init__(self, model_name: str = "llama3.1", host: str = None, residency=None, batch_endpoint: bool = False):
         self.model_name = model_name
-        self.api_url = "http://127.0.0.1:11434/api/embeddings"
+        # Optional ModelResidencyManager: supplies keep_alive and tracks model switches
+        self.residency = residency
+        host = (host or 'http://127.0.0.1:11434').rstrip('/')
+        self.api_url = f"{host}/api/embeddings"
+        # /api/embed takes a list of inputs in one request, but returns L2-normalised vectors,
+        # so switching an existing Chroma index over to it requires re-embedding
+        self.batch_endpoint = batch_endpoint
+        self.batch_api_url = f"{host}/api/embed"
         self.logger = logging.getLogger(__name__)
 
+    def _payload(self, payload: Dict) -> Dict:
+        if self.residency:
+            self.residency.record_use(self.model_name)
+            payload["keep_alive"] = self.residency.keep_alive
+        return payload
+
+    @staticmethod
+    def prompt(text: str, context: str) -> str:
+        return f"Context: {context}\n\nText: {text}"
+
     def generate_embeddings(self, texts: List[str], context: str) -> List[List[float]]:
+        return self.embed_prompts([self.prompt(text, context) for text in texts])
+
+    # Embed fully formed prompts, which lets a caller mix texts with different contexts in one batch.
+    def embed_prompts(self, prompts: List[str]) -> List[List[float]]:
+        if self.batch_endpoint:
+            return self._embed_prompts_batch(prompts)
         embeddings = []
-        for text in texts:
-            prompt = f"Context: {context}\n\nText: {text}"
+        for prompt in prompts:
+            payload = self._payload({"model": self.model_name, "prompt": prompt})
             try:
-                response = requests.post(self.api_url, json={"model": self.model_name, "prompt": prompt})
+                with instrumentation.span("ollama.embeddings", {"model": self.model_name}):
+                    response = requests.post(self.api_url, json=payload)
                 response.raise_for_status()
                 embedding = response.json()["embedding"]
                 embeddings.append(embedding)
             except requests.exceptions.RequestException as e:
-                self.logger.error(f"Ollama API failed to generate embeddings for text: {text}")
+                self.logger.error(f"Ollama API failed to generate embeddings for text: {prompt}")
                 self.logger.error(f"Error: {e}")
             except KeyError as e:
                 self.logger.error(f"Ollama API returned an invalid response: {response.text}")
@@ -34,9 +60,80 @@ class OllamaEmbeddings(EmbeddingProvider):
             except Exception as e:
                 self.logger.error(f"Unexpected error: {e}")
                 continue
+        instrumentation.increment("embedding.texts", len(prompts), {"model": self.model_name})
+        return embeddings
+
+    # One request for all prompts. On failure nothing is returned, so callers never get
+    # embeddings that are misaligned with their texts.
+    def _embed_prompts_batch(self, prompts: List[str]) -> List[List[float]]:
+        if not prompts:
+            return []
+        payload = self._payload({"model": self.model_name, "input": prompts})
+        try:
+            with instrumentation.span("ollama.embed_batch", {"model": self.model_name}):
+                response = requests.post(self.batch_api_url, json=payload)
+            response.raise_for_status()
+            embeddings = response.json()["embeddings"]
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Ollama API failed to generate embeddings for a batch of {len(prompts)} texts")
+            self.logger.error(f"Error: {e}")
+            return []
+        except KeyError as e:
+            self.logger.error(f"Ollama API returned an invalid response: {response.text}")
+            self.logger.error(f"Error: {e}")
+            return []
+        instrumentation.increment("embedding.texts", len(prompts), {"model": self.model_name})
         return embeddings
 
 
+# Sits in front of another provider and merges concurrent single-text requests into one
+# backend call (see MicroBatcher), trading up to max_wait_ms of latency for throughput. Providers
+# with embed_prompts() get one call per batch whatever the contexts; others get one per context.
+# The gain needs a backend that embeds a batch in one request, i.e. OllamaEmbeddings(batch_endpoint=True).
+class CoalescingEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, provider: EmbeddingProvider, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.provider = provider
+        self.logger = logging.getLogger(__name__)
+        self.batcher = MicroBatcher(self._embed_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms, name="embeddings")
+
+    def generate_embeddings(self, texts: List[str], context: str) -> List[List[float]]:
+        futures = [self.batcher.submit((text, context)) for text in texts]
+        embeddings = []
+        for future in futures:
+            try:
+                embedding = future.result()
+            except Exception as e:
+                self.logger.error(f"Error: {e}")
+                continue
+            # Texts the backend failed to embed are dropped, as OllamaEmbeddings does
+            if embedding is not None:
+                embeddings.append(embedding)
+        return embeddings
+
+    def _embed_batch(self, items: List[tuple]) -> List[List[float]]:
+        if hasattr(self.provider, "embed_prompts"):
+            embeddings = self.provider.embed_prompts([self.provider.prompt(text, context) for text, context in items])
+            if len(embeddings) != len(items):
+                self.logger.error(f"Embedding provider returned {len(embeddings)} embeddings for {len(items)} texts")
+                return [None] * len(items)
+            return embeddings
+        results = [None] * len(items)
+        by_context = {}
+        for i, (_, context) in enumerate(items):
+            by_context.setdefault(context, []).append(i)
+        for context, indices in by_context.items():
+            embeddings = self.provider.generate_embeddings([items[i][0] for i in indices], context)
+            if len(embeddings) != len(indices):
+                self.logger.error(f"Embedding provider returned {len(embeddings)} embeddings for {len(indices)} texts")
+                continue
+            for i, embedding in zip(indices, embeddings):
+                results[i] = embedding
+        return results
+
+    def close(self):
+        self.batcher.close()
+
 
 
 class ContextualEmbeddings:
@@ -0,0 +1,187 @@
+import sqlite3
+import hashlib
+import json
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Tracks which chunks were ingested for each document, keyed by content hash, so that
+# re-ingesting a file only embeds the chunks that changed and drops the ones that vanished.
+class DocumentManifest:
+    def __init__(self, db_path: str = 'document_manifest.db'):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            file_name TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            num_chunks INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chunks (
+            chunk_id TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            chunk_hash TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            term_ids BLOB
+        )
+        ''')
+        # Manifests created before term ids and sources were stored lack the columns
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(chunks)')]
+        if 'term_ids' not in columns:
+            cursor.execute('ALTER TABLE chunks ADD COLUMN term_ids BLOB')
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(documents)')]
+        if 'source' not in columns:
+            cursor.execute('ALTER TABLE documents ADD COLUMN source TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_name ON chunks (file_name)')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS terms (
+            term_id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    # Metadata is part of the document hash so that a changed title still refreshes chunk metadata.
+    @classmethod
+    def hash_document(cls, text: str, metadata: Dict) -> str:
+        return cls.hash_text(text + json.dumps(metadata, sort_keys=True, default=str))
+
+    # Chunk ids are derived from the chunk content rather than its position, so inserting a
+    # paragraph does not shift the ids of every following chunk. Repeated chunks get a suffix.
+    @classmethod
+    def chunk_ids(cls, file_name: str, chunks: List[str]) -> List[Tuple[str, str]]:
+        seen = {}
+        entries = []
+        for chunk in chunks:
+            chunk_hash = cls.hash_text(chunk)
+            occurrence = seen.get(chunk_hash, 0)
+            seen[chunk_hash] = occurrence + 1
+            chunk_id = f"doc_{file_name}_{chunk_hash[:16]}"
+            if occurrence:
+                chunk_id += f"_{occurrence}"
+            entries.append((chunk_id, chunk_hash))
+        return entries
+
+    def get_document_hash(self, file_name: str) -> Optional[str]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT content_hash FROM documents WHERE file_name = ?', (file_name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_chunks(self, file_name: str) -> Dict[str, str]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT chunk_id, chunk_hash FROM chunks WHERE file_name = ?', (file_name,))
+        return dict(cursor.fetchall())
+
+    # The file each chunk belongs to; chunk ids the manifest does not know are left out.
+    def get_file_names(self, chunk_ids: List[str], batch_size: int = 500) -> Dict[str, str]:
+        file_names = {}
+        for start in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[start:start + batch_size]
+            cursor = self.conn.execute(
+                f'SELECT chunk_id, file_name FROM chunks WHERE chunk_id IN ({",".join("?" * len(batch))})', batch)
+            file_names.update(cursor.fetchall())
+        return file_names
+
+    # With a source, only the documents that were ingested from it, e.g. one synced directory.
+    def list_documents(self, source: str = None) -> List[str]:
+        cursor = self.conn.cursor()
+        if source is None:
+            cursor.execute('SELECT file_name FROM documents ORDER BY file_name')
+        else:
+            cursor.execute('SELECT file_name FROM documents WHERE source = ? ORDER BY file_name', (source,))
+        return [file_name for (file_name,) in cursor.fetchall()]
+
+    def get_document_source(self, file_name: str) -> Optional[str]:
+        row = self.conn.execute('SELECT source FROM documents WHERE file_name = ?', (file_name,)).fetchone()
+        return row[0] if row else None
+
+    def set_document_source(self, file_name: str, source: Optional[str]):
+        with self.conn:
+            self.conn.execute('UPDATE documents SET source = ? WHERE file_name = ?', (source, file_name))
+
+    # Changes whenever any document is added, changed or removed; used to key cached retrieval results.
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for file_name, content_hash in self.conn.execute('SELECT file_name, content_hash FROM documents ORDER BY file_name'):
+            digest.update(f"{file_name}\0{content_hash}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    # term_arrays holds each chunk's analyzed term ids, stored with the chunk so the lexical
+    # index can be rebuilt at startup without re-reading or re-tokenizing any text.
+    # source records where the document came from, such as the directory it was synced from.
+    def save_document(self, file_name: str, content_hash: str, chunk_entries: List[Tuple[str, str]],
+                      term_arrays: List[array] = None, source: str = None):
+        if term_arrays is None:
+            term_arrays = [None] * len(chunk_entries)
+        with self.conn:
+            self.conn.execute('DELETE FROM chunks WHERE file_name = ?', (file_name,))
+            self.conn.executemany(
+                'INSERT INTO chunks (chunk_id, file_name, chunk_hash, chunk_index, term_ids) VALUES (?, ?, ?, ?, ?)',
+                [(chunk_id, file_name, chunk_hash, i, terms.tobytes() if terms is not None else None)
+                 for i, ((chunk_id, chunk_hash), terms) in enumerate(zip(chunk_entries, term_arrays))]
+            )
+            self.conn.execute('''
+            INSERT OR REPLACE INTO documents (file_name, content_hash, num_chunks, source, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (file_name, content_hash, len(chunk_entries), source))
+
+    def iter_chunk_term_ids(self) -> Iterator[Tuple[str, array]]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT chunk_id, term_ids FROM chunks WHERE term_ids IS NOT NULL ORDER BY rowid')
+        for chunk_id, blob in cursor:
+            terms = array('I')
+            terms.frombytes(blob)
+            yield chunk_id, terms
+
+    # The analyzer vocabulary, in term id order.
+    def get_terms(self) -> List[str]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT term FROM terms ORDER BY term_id')
+        return [term for (term,) in cursor.fetchall()]
+
+    # Term ids are only ever appended, so saving stores the terms beyond those already saved.
+    def save_terms(self, terms: List[str]):
+        with self.conn:
+            (saved,) = self.conn.execute('SELECT COUNT(*) FROM terms').fetchone()
+            self.conn.executemany('INSERT INTO terms (term_id, term) VALUES (?, ?)',
+                                  [(term_id, terms[term_id]) for term_id in range(saved, len(terms))])
+
+    # Index settings the stored chunks depend on, such as the shard layout they were placed with.
+    def get_setting(self, key: str, default: str = None) -> Optional[str]:
+        row = self.conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key: str, value):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def remove_document(self, file_name: str):
+        with self.conn:
+            self.conn.execute('DELETE FROM chunks WHERE file_name = ?', (file_name,))
+            self.conn.execute('DELETE FROM documents WHERE file_name = ?', (file_name,))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM chunks')
+            self.conn.execute('DELETE FROM documents')
+            self.conn.execute('DELETE FROM terms')
+
+    def close(self):
+        self.conn.close()
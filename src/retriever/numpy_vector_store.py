@@ -0,0 +1,354 @@
+import os
+import json
+import sqlite3
+from typing import Dict, Iterator, List, Sequence
+import numpy as np
+from ..utils.instrumentation import instrumentation
+from .vector_store import page_records
+
+
+# VectorStore-compatible index over a memory-mapped matrix of normalised embeddings, searched
+# exactly by cosine similarity. Deleted rows are tombstoned and compacted past COMPACT_RATIO.
+class NumpyVectorStore:
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    INT8_SCALE = 127.0
+    SEARCH_BLOCK_ROWS = 65536
+    COMPACT_RATIO = 0.25
+    MATRIX_FILE = "embeddings.bin"
+
+    def __init__(self,
+                 collection_name: str = "local_knowledge_base",
+                 persist_directory: str = "./numpy_index", embedding_provider=None,
+                 dtype: str = "float32"):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {list(self.DTYPES)}")
+        self.name = collection_name
+        self.persist_directory = os.path.join(persist_directory, collection_name)
+        self.embedding_provider = embedding_provider
+        os.makedirs(self.persist_directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(self.persist_directory, "documents.db"), check_same_thread=False)
+        self.create_tables()
+        self.dtype = self._get_meta("dtype", dtype)
+        self.dim = int(self._get_meta("dim", 0))
+        self.capacity = 0
+        self.matrix = None
+        self._load_index()
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            row INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            document TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''')
+        self.conn.commit()
+
+    def _get_meta(self, key: str, default):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.persist_directory, self.matrix_file)
+
+    # Rebuild the id map and tombstone mask from the sqlite table and map the embedding file.
+    def _load_index(self):
+        self.matrix_file = self._get_meta("matrix_file", self.MATRIX_FILE)
+        self._remove_stale_matrices()
+        rows = self.conn.execute("SELECT row, id FROM documents").fetchall()
+        self.id_to_row = {doc_id: row for row, doc_id in rows}
+        self.size = int(self._get_meta("size", 0))
+        self.alive = np.zeros(self.size, dtype=bool)
+        if rows:
+            self.alive[[row for row, _ in rows]] = True
+        if self.dim and os.path.exists(self._matrix_path):
+            itemsize = np.dtype(self.DTYPES[self.dtype]).itemsize
+            self.capacity = os.path.getsize(self._matrix_path) // (self.dim * itemsize)
+            self._open_matrix()
+
+    def _open_matrix(self):
+        self.matrix = np.memmap(self._matrix_path, dtype=self.DTYPES[self.dtype], mode="r+",
+                                shape=(self.capacity, self.dim))
+
+    # Grow the backing file geometrically so appends stay amortised O(1).
+    def _ensure_capacity(self, rows: int):
+        if rows <= self.capacity:
+            return
+        new_capacity = max(rows, self.capacity * 2, 1024)
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        itemsize = np.dtype(self.DTYPES[self.dtype]).itemsize
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * itemsize)
+        self.capacity = new_capacity
+        self._open_matrix()
+
+    def _encode(self, embeddings) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got shape {vectors.shape}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1)
+        if self.dtype == "int8":
+            return np.round(vectors * self.INT8_SCALE).astype(np.int8)
+        return vectors.astype(self.DTYPES[self.dtype])
+
+    def add_documents(self, texts: list[str], metadata: list[dict] = None, ids: list[str] = None):
+        if ids is None:
+            ids = [f"doc_{i}" for i in range(len(texts))]
+        embeddings = self.embedding_provider.generate_embeddings(texts, "")
+        self.add_embeddings(ids, texts, embeddings, metadata)
+
+    # Upsert precomputed embeddings. Existing ids are overwritten in place, new ids are appended.
+    def add_embeddings(self, ids: List[str], texts: List[str], embeddings, metadata: List[Dict] = None):
+        with instrumentation.span("numpy_index.upsert"):
+            self._add_embeddings(ids, texts, embeddings, metadata)
+
+    def _add_embeddings(self, ids: List[str], texts: List[str], embeddings, metadata: List[Dict] = None):
+        if len(embeddings) != len(ids):
+            raise ValueError(f"Got {len(embeddings)} embeddings for {len(ids)} documents")
+        if not ids:
+            return
+        if not self.dim:
+            self.dim = len(embeddings[0])
+            self._set_meta("dim", self.dim)
+            self._set_meta("dtype", self.dtype)
+        vectors = self._encode(embeddings)
+        metadata = metadata if metadata else [{}] * len(texts)
+
+        rows = []
+        for doc_id in ids:
+            row = self.id_to_row.get(doc_id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                self.id_to_row[doc_id] = row
+            rows.append(row)
+        self._ensure_capacity(self.size)
+        if self.size > len(self.alive):
+            self.alive = np.concatenate([self.alive, np.zeros(self.size - len(self.alive), dtype=bool)])
+
+        self.matrix[rows] = vectors
+        self.alive[rows] = True
+        self.matrix.flush()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO documents (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+            [(row, doc_id, text, json.dumps(meta)) for row, doc_id, text, meta in zip(rows, ids, texts, metadata)]
+        )
+        self._set_meta("size", self.size)
+        self.conn.commit()
+
+    # Exact top-k by cosine similarity. Scores are cosine distances (1 - similarity), lower is closer.
+    def query_embedding(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
+        with instrumentation.span("numpy_index.query"):
+            return self._query_embedding(query_embedding, top_k)
+
+    def _query_embedding(self, query_embedding: List[float], top_k: int) -> List[Dict]:
+        if not self.dim or not self.alive.any():
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm > 0 else query
+
+        similarities = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, self.SEARCH_BLOCK_ROWS):
+            end = min(start + self.SEARCH_BLOCK_ROWS, self.size)
+            similarities[start:end] = self.matrix[start:end].astype(np.float32) @ query
+        if self.dtype == "int8":
+            similarities /= self.INT8_SCALE
+        similarities[~self.alive[:self.size]] = -np.inf
+
+        k = min(top_k, int(self.alive.sum()))
+        top_rows = np.argpartition(-similarities, k - 1)[:k]
+        top_rows = top_rows[np.argsort(-similarities[top_rows])]
+
+        documents = self._fetch_rows(top_rows.tolist())
+        return [
+            {"id": documents[row][0], "text": documents[row][1], "score": float(1.0 - similarities[row])}
+            for row in top_rows.tolist()
+        ]
+
+    def similarity_search(self, query: str, context: str, top_k: int = 5) -> List[Dict]:
+        query_embedding = self.embedding_provider.generate_embeddings([query], context)[0]
+        return self.query_embedding(query_embedding, top_k)
+
+    def query(self, query_embedding: list[float], n_results: int = 5):
+        results = self.query_embedding(query_embedding, n_results)
+        return {
+            "ids": [[r["id"] for r in results]],
+            "documents": [[r["text"] for r in results]],
+            "distances": [[r["score"] for r in results]],
+        }
+
+    def _fetch_rows(self, rows: List[int]) -> Dict[int, tuple]:
+        placeholders = ",".join("?" * len(rows))
+        cursor = self.conn.execute(
+            f"SELECT row, id, document, metadata FROM documents WHERE row IN ({placeholders})", rows)
+        return {row: (doc_id, document, metadata) for row, doc_id, document, metadata in cursor.fetchall()}
+
+    def remove_documents(self, ids: List[str]):
+        rows = [self.id_to_row.pop(doc_id) for doc_id in ids if doc_id in self.id_to_row]
+        if not rows:
+            return
+        self.alive[rows] = False
+        self.conn.executemany("DELETE FROM documents WHERE row = ?", [(row,) for row in rows])
+        self.conn.commit()
+        if self.size - len(self.id_to_row) > self.COMPACT_RATIO * self.size:
+            self.compact()
+
+    def update_document(self, id: str, text: str, metadata: Dict = None):
+        if id not in self.id_to_row:
+            return
+        if metadata is None:
+            metadata = self.get_document_by_id(id)["metadatas"][0]
+        embedding = self.embedding_provider.generate_embeddings([text], "")
+        self.add_embeddings([id], [text], embedding, [metadata])
+
+    # Refresh metadata in place without re-embedding the documents.
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]):
+        self.conn.executemany(
+            "UPDATE documents SET metadata = ? WHERE id = ?",
+            [(json.dumps(metadata), doc_id) for doc_id, metadata in zip(ids, metadatas)]
+        )
+        self.conn.commit()
+
+    def get_all_documents(self):
+        cursor = self.conn.execute("SELECT id, document, metadata FROM documents ORDER BY row")
+        return self._to_result(cursor.fetchall())
+
+    def count(self) -> int:
+        return len(self.id_to_row)
+
+    # One page in row order, in the same column layout as VectorStore.get_documents.
+    def get_documents(self, limit: int, offset: int = 0, include: Sequence[str] = ("documents", "metadatas")) -> Dict:
+        cursor = self.conn.execute(
+            "SELECT row, id, document, metadata FROM documents ORDER BY row LIMIT ? OFFSET ?", (limit, offset))
+        return self._to_page(cursor.fetchall(), include)
+
+    # Keyset pagination on the row number: each page is an index range scan, however deep the iteration.
+    def iter_documents(self, batch_size: int = 1000, include: Sequence[str] = ("documents", "metadatas")) -> Iterator[Dict]:
+        last_row = -1
+        while True:
+            records = self.conn.execute(
+                "SELECT row, id, document, metadata FROM documents WHERE row > ? ORDER BY row LIMIT ?",
+                (last_row, batch_size)).fetchall()
+            yield from page_records(self._to_page(records, include), include)
+            if len(records) < batch_size:
+                return
+            last_row = records[-1][0]
+
+    def _to_page(self, records, include: Sequence[str]) -> Dict:
+        page = {"ids": [doc_id for _, doc_id, _, _ in records]}
+        if "documents" in include:
+            page["documents"] = [document for _, _, document, _ in records]
+        if "metadatas" in include:
+            page["metadatas"] = [json.loads(metadata) for _, _, _, metadata in records]
+        if "embeddings" in include:
+            page["embeddings"] = list(self._decode([row for row, _, _, _ in records]))
+        return page
+
+    # Stored rows as float32, undoing int8 scaling. Vectors are the normalised ones, not the originals.
+    def _decode(self, rows: List[int]) -> np.ndarray:
+        if not rows:
+            return np.empty((0, self.dim), dtype=np.float32)
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32)
+        return vectors / self.INT8_SCALE if self.dtype == "int8" else vectors
+
+    def get_document_by_id(self, id: str):
+        cursor = self.conn.execute("SELECT id, document, metadata FROM documents WHERE id = ?", (id,))
+        return self._to_result(cursor.fetchall())
+
+    @staticmethod
+    def _to_result(rows) -> Dict:
+        return {
+            "ids": [doc_id for doc_id, _, _ in rows],
+            "documents": [document for _, document, _ in rows],
+            "metadatas": [json.loads(metadata) for _, _, metadata in rows],
+        }
+
+    # Rewrite the matrix without tombstoned rows, so searches stop scanning deleted embeddings.
+    def compact(self):
+        with instrumentation.span("numpy_index.compact"):
+            self._compact()
+
+    # The compacted matrix is written to a new file, and the sqlite transaction that renumbers the
+    # rows also switches meta.matrix_file over to it. Until that commit the old file and rows stay
+    # in use, so a failure at any point leaves either the old index or the new one, never a mix.
+    def _compact(self):
+        live_rows = np.flatnonzero(self.alive[:self.size])
+        if len(live_rows) == self.size:
+            return
+        generation = int(self._get_meta("generation", 0)) + 1
+        new_file = f"embeddings.{generation}.bin"
+        new_path = os.path.join(self.persist_directory, new_file)
+        if len(live_rows):
+            tmp_path = f"{new_path}.tmp"
+            matrix = np.memmap(tmp_path, dtype=self.DTYPES[self.dtype], mode="w+", shape=(len(live_rows), self.dim))
+            for start in range(0, len(live_rows), self.SEARCH_BLOCK_ROWS):
+                matrix[start:start + self.SEARCH_BLOCK_ROWS] = self.matrix[live_rows[start:start + self.SEARCH_BLOCK_ROWS]]
+            matrix.flush()
+            del matrix
+            os.replace(tmp_path, new_path)
+
+        remap = {int(old): new for new, old in enumerate(live_rows)}
+        records = self.conn.execute("SELECT row, id, document, metadata FROM documents").fetchall()
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM documents")
+                self.conn.executemany(
+                    "INSERT INTO documents (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(remap[row], doc_id, document, metadata) for row, doc_id, document, metadata in records]
+                )
+                self._set_meta("size", len(live_rows))
+                self._set_meta("generation", generation)
+                self._set_meta("matrix_file", new_file)
+        except Exception:
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            raise
+
+        self.matrix = None
+        self.matrix_file = new_file
+        self._remove_stale_matrices()
+        self.size = len(live_rows)
+        self.capacity = len(live_rows)
+        self.id_to_row = {doc_id: remap[row] for row, doc_id, _, _ in records}
+        self.alive = np.ones(self.size, dtype=bool)
+        if self.size:
+            self._open_matrix()
+
+    # Matrix files left behind by a compaction that was interrupted or superseded.
+    def _remove_stale_matrices(self):
+        for name in os.listdir(self.persist_directory):
+            if name.startswith("embeddings") and name.endswith((".bin", ".bin.tmp")) and name != self.matrix_file:
+                os.remove(os.path.join(self.persist_directory, name))
+
+    def clear_database(self):
+        self.matrix = None
+        if os.path.exists(self._matrix_path):
+            os.remove(self._matrix_path)
+        self.conn.execute("DELETE FROM documents")
+        self.conn.execute("DELETE FROM meta")
+        self.conn.commit()
+        self.dim = 0
+        self.capacity = 0
+        self._load_index()
+
+    def close(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.conn.close()
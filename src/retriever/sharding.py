@@ -0,0 +1,419 @@
+import os
+import zlib
+import atexit
+import logging
+import argparse
+import threading
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from ..preprocess.analyzer import TextAnalyzer
+from ..utils.instrumentation import instrumentation
+from .contextual_bm25 import ContextualBM25
+from .vector_store import page_records
+
+logger = logging.getLogger(__name__)
+
+
+# Chunks are placed by their id, which embeds the chunk's content hash, so shards fill evenly
+# and a chunk stays on the same shard for as long as its content is unchanged.
+def shard_for(doc_id: str, num_shards: int) -> int:
+    return zlib.crc32(doc_id.encode("utf-8")) % num_shards
+
+
+def create_shard_store(backend: str, persist_directory: str, dtype: str = "float32"):
+    if backend == "numpy":
+        from .numpy_vector_store import NumpyVectorStore
+        return NumpyVectorStore(persist_directory=persist_directory, dtype=dtype)
+    if backend != "chroma":
+        raise ValueError(f"Unknown vector store backend: {backend}")
+    from .vector_store import VectorStore
+    return VectorStore(persist_directory=persist_directory)
+
+
+# One partition of the knowledge base: a vector store plus a lexical index, both holding only
+# this shard's chunks. Term ids come from the coordinator's analyzer, so they are global ids.
+class IndexShard:
+    RPC_METHODS = {
+        "add_embeddings", "query_embedding", "remove_documents", "update_metadata", "get_document_by_id",
+        "get_documents", "count", "clear_database", "add_term_ids", "remove_term_ids", "missing_ids",
+        "lexical_frequencies", "lexical_statistics", "top_documents", "get_term_ids",
+    }
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+        self.bm25 = ContextualBM25()
+
+    def add_embeddings(self, ids, texts, embeddings, metadata=None):
+        self.vector_store.add_embeddings(ids, texts, embeddings, metadata)
+
+    def query_embedding(self, query_embedding, top_k):
+        return self.vector_store.query_embedding(query_embedding, top_k)
+
+    def remove_documents(self, ids):
+        self.vector_store.remove_documents(ids)
+
+    def update_metadata(self, ids, metadatas):
+        self.vector_store.update_metadata(ids, metadatas)
+
+    def get_document_by_id(self, id):
+        return self.vector_store.get_document_by_id(id)
+
+    def get_documents(self, limit, offset=0, include=("documents", "metadatas")):
+        page = self.vector_store.get_documents(limit, offset, include)
+        # Chroma returns numpy arrays and extra keys; send plain columns over the wire
+        return {key: [v.tolist() if hasattr(v, "tolist") else v for v in page[key]] for key in ["ids", *include]}
+
+    def count(self):
+        return self.vector_store.count()
+
+    def clear_database(self):
+        self.vector_store.clear_database()
+        self.bm25 = ContextualBM25()
+
+    # Re-adding an id replaces it, so a coordinator restart can reload a long-running shard.
+    def add_term_ids(self, ids, term_arrays):
+        present = set(ids) - set(self.bm25.missing_ids(ids))
+        if present:
+            self.bm25.remove_documents(list(present))
+        self.bm25.add_term_ids(ids, term_arrays)
+
+    def remove_term_ids(self, ids):
+        self.bm25.remove_documents(ids)
+
+    def missing_ids(self, ids):
+        return self.bm25.missing_ids(ids)
+
+    def lexical_frequencies(self, term_ids, ids):
+        return self.bm25.statistics(term_ids), self.bm25.term_frequencies(ids, term_ids)
+
+    def lexical_statistics(self, term_ids):
+        return self.bm25.statistics(term_ids)
+
+    def top_documents(self, query_terms, boosts, statistics, top_k):
+        return self.bm25.top_documents(query_terms, boosts, statistics, top_k)
+
+    def get_term_ids(self, doc_id):
+        return self.bm25.get_term_ids(doc_id)
+
+
+def _handle(shard: IndexShard, conn, lock: threading.Lock):
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            if method not in IndexShard.RPC_METHODS:
+                conn.send(("error", f"Unknown shard method: {method}"))
+                continue
+            try:
+                with lock:
+                    result = getattr(shard, method)(*args)
+                conn.send(("ok", result))
+            except Exception as e:
+                logger.exception("Shard call %s failed", method)
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# Serve one shard until the process is stopped. Each connection is served on its own thread, so
+# a second coordinator (or a stale connection from a crashed one) never blocks the others; calls
+# are serialised by a lock, so the shard's stores never see concurrent calls.
+def serve_shard(shard_id: int, backend: str, persist_directory: str, dtype: str, address, authkey: bytes,
+                ready=None):
+    store = create_shard_store(backend, os.path.join(persist_directory, f"shard_{shard_id}"), dtype)
+    shard = IndexShard(store)
+    lock = threading.Lock()
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # A client that fails the authkey handshake must not stop the shard
+                logger.warning("Rejected shard connection: %s", e)
+                continue
+            threading.Thread(target=_handle, args=(shard, conn, lock), daemon=True,
+                             name=f"shard-{shard_id}-conn").start()
+
+
+class ShardClient:
+    def __init__(self, address, authkey: bytes, shard_id: int):
+        self.address = address
+        self.shard_id = shard_id
+        self.conn = Client(address, authkey=authkey)
+        self._lock = threading.Lock()
+
+    def call(self, method: str, *args):
+        with self._lock:
+            self.conn.send((method, args))
+            status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Shard {self.shard_id} at {self.address}: {result}")
+        return result
+
+    def close(self):
+        self.conn.close()
+
+
+# Starts local shard worker processes, or connects to shards already serving on other hosts,
+# and fans calls out to them in parallel.
+class ShardPool:
+    def __init__(self, num_shards: int = 2, backend: str = "chroma", persist_directory: str = "./shards",
+                 dtype: str = "float32", addresses: Sequence[str] = (), authkey: bytes = None):
+        self.processes = []
+        if addresses:
+            if authkey is None:
+                raise ValueError("An authkey is required to connect to remote shards")
+            resolved = [self._parse_address(address) for address in addresses]
+        else:
+            authkey = authkey or os.urandom(16)
+            resolved = self._start_workers(num_shards, backend, persist_directory, dtype, authkey)
+        self.clients = [ShardClient(address, authkey, i) for i, address in enumerate(resolved)]
+        self.num_shards = len(self.clients)
+        self.executor = ThreadPoolExecutor(max_workers=self.num_shards, thread_name_prefix="shard")
+        atexit.register(self.close)
+
+    @staticmethod
+    def _parse_address(address: str) -> Tuple[str, int]:
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+
+    def _start_workers(self, num_shards, backend, persist_directory, dtype, authkey):
+        # spawn rather than fork: the parent may already hold sqlite and Chroma handles
+        context = multiprocessing.get_context("spawn")
+        ready_pipes = []
+        for shard_id in range(num_shards):
+            parent_end, child_end = context.Pipe(duplex=False)
+            process = context.Process(
+                target=serve_shard, name=f"shard-{shard_id}", daemon=True,
+                args=(shard_id, backend, persist_directory, dtype, ("127.0.0.1", 0), authkey, child_end),
+            )
+            process.start()
+            child_end.close()
+            self.processes.append(process)
+            ready_pipes.append(parent_end)
+        return [ready.recv() for ready in ready_pipes]
+
+    def call(self, shard_id: int, method: str, *args):
+        return self.clients[shard_id].call(method, *args)
+
+    # Call every shard in parallel, with per-shard arguments when args_per_shard is given.
+    def scatter(self, method: str, *args, args_per_shard: List[tuple] = None) -> List:
+        calls = args_per_shard if args_per_shard is not None else [args] * self.num_shards
+        with instrumentation.span("shards.scatter", {"method": method}):
+            futures = [self.executor.submit(client.call, method, *call_args)
+                       for client, call_args in zip(self.clients, calls)]
+            return [future.result() for future in futures]
+
+    # Group parallel lists by the shard that owns each id; returns {shard_id: (ids, *columns)}.
+    def partition(self, ids: List[str], *columns) -> Dict[int, tuple]:
+        groups = {}
+        for i, doc_id in enumerate(ids):
+            groups.setdefault(shard_for(doc_id, self.num_shards), []).append(i)
+        return {
+            shard_id: ([ids[i] for i in positions],
+                       *([column[i] for i in positions] if column is not None else None for column in columns))
+            for shard_id, positions in groups.items()
+        }
+
+    def scatter_partitioned(self, method: str, ids: List[str], *columns):
+        groups = self.partition(ids, *columns)
+        futures = {shard_id: self.executor.submit(self.clients[shard_id].call, method, *group)
+                   for shard_id, group in groups.items()}
+        return {shard_id: future.result() for shard_id, future in futures.items()}
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        for process in self.processes:
+            process.terminate()
+            process.join(timeout=5)
+        self.processes = []
+        self.executor.shutdown(wait=False)
+
+
+# The VectorStore interface over a ShardPool: writes go to the shard owning each id, searches
+# go to every shard and the per-shard top-k lists are merged by distance.
+class ShardedVectorStore:
+    def __init__(self, pool: ShardPool, embedding_provider=None):
+        self.pool = pool
+        self.embedding_provider = embedding_provider
+
+    def add_documents(self, texts: list[str], metadata: list[dict] = None, ids: list[str] = None):
+        if ids is None:
+            ids = [f"doc_{i}" for i in range(len(texts))]
+        embeddings = self.embedding_provider.generate_embeddings(texts, "")
+        self.add_embeddings(ids, texts, embeddings, metadata)
+
+    def add_embeddings(self, ids: List[str], texts: List[str], embeddings, metadata: List[Dict] = None):
+        embeddings = embeddings.tolist() if hasattr(embeddings, "tolist") else list(embeddings)
+        self.pool.scatter_partitioned("add_embeddings", ids, texts, embeddings, metadata or None)
+
+    def similarity_search(self, query: str, context: str, top_k: int = 5) -> List[Dict]:
+        query_embedding = self.embedding_provider.generate_embeddings([query], context)[0]
+        return self.query_embedding(query_embedding, top_k)
+
+    # Distances are computed against the same embedding model on every shard, so they are
+    # directly comparable and the global top-k is the best top_k of the per-shard top-k lists.
+    def query_embedding(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
+        query_embedding = list(map(float, query_embedding))
+        shard_results = self.pool.scatter("query_embedding", query_embedding, top_k)
+        merged = [result for results in shard_results for result in results]
+        return sorted(merged, key=lambda result: result["score"])[:top_k]
+
+    def query(self, query_embedding: list[float], n_results: int = 5):
+        results = self.query_embedding(query_embedding, n_results)
+        return {
+            "ids": [[r["id"] for r in results]],
+            "documents": [[r["text"] for r in results]],
+            "distances": [[r["score"] for r in results]],
+        }
+
+    def remove_documents(self, ids: List[str]):
+        self.pool.scatter_partitioned("remove_documents", ids)
+
+    def update_document(self, id: str, text: str, metadata: Dict = None):
+        if metadata is None:
+            metadatas = self.get_document_by_id(id)["metadatas"]
+            metadata = metadatas[0] if metadatas else None
+        embedding = self.embedding_provider.generate_embeddings([text], "")
+        self.add_embeddings([id], [text], embedding, [metadata] if metadata else None)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]):
+        self.pool.scatter_partitioned("update_metadata", ids, metadatas)
+
+    def get_document_by_id(self, id: str):
+        return self.pool.call(shard_for(id, self.pool.num_shards), "get_document_by_id", id)
+
+    def count(self) -> int:
+        return sum(self.pool.scatter("count"))
+
+    # Shard by shard, one page at a time.
+    def iter_documents(self, batch_size: int = 1000, include: Sequence[str] = ("documents", "metadatas")) -> Iterator[Dict]:
+        for shard_id in range(self.pool.num_shards):
+            offset = 0
+            while True:
+                page = self.pool.call(shard_id, "get_documents", batch_size, offset, list(include))
+                yield from page_records(page, include)
+                if len(page["ids"]) < batch_size:
+                    break
+                offset += batch_size
+
+    def get_all_documents(self):
+        result = {"ids": [], "documents": [], "metadatas": []}
+        for doc in self.iter_documents():
+            result["ids"].append(doc["id"])
+            result["documents"].append(doc["text"])
+            result["metadatas"].append(doc["metadata"])
+        return result
+
+    def clear_database(self):
+        self.pool.scatter("clear_database")
+
+
+# The ContextualBM25 interface over a ShardPool. Each shard indexes its own chunks; at query time
+# every shard reports its corpus statistics for the query terms, which are summed so that IDF and
+# average document length are those of the whole knowledge base, and candidates are scored with
+# the same global statistics whichever shard they came from.
+class ShardedBM25(ContextualBM25):
+    def __init__(self, pool: ShardPool, k1: float = 1.5, b: float = 0.75, analyzer: TextAnalyzer = None):
+        super().__init__(k1=k1, b=b, analyzer=analyzer)
+        self.pool = pool
+
+    def add_term_ids(self, ids: List[Optional[str]], term_arrays: List[array]):
+        indexed = [(doc_id, terms) for doc_id, terms in zip(ids, term_arrays) if doc_id is not None and len(terms)]
+        if not indexed:
+            logger.warning("No valid documents to add")
+            return
+        self.pool.scatter_partitioned("add_term_ids", [doc_id for doc_id, _ in indexed], [terms for _, terms in indexed])
+
+    def remove_documents(self, ids: List[str]):
+        self.pool.scatter_partitioned("remove_term_ids", ids)
+
+    def missing_ids(self, ids: List[str]) -> List[str]:
+        missing = set()
+        for shard_missing in self.pool.scatter_partitioned("missing_ids", ids).values():
+            missing.update(shard_missing)
+        return [doc_id for doc_id in ids if doc_id in missing]
+
+    def get_term_ids(self, doc_id: str) -> Optional[array]:
+        return self.pool.call(shard_for(doc_id, self.pool.num_shards), "get_term_ids", doc_id)
+
+    @staticmethod
+    def _sum_statistics(shard_statistics: List[Dict], num_terms: int) -> Dict:
+        statistics = {"num_docs": 0, "total_length": 0, "doc_freqs": [0] * num_terms}
+        for shard in shard_statistics:
+            statistics["num_docs"] += shard["num_docs"]
+            statistics["total_length"] += shard["total_length"]
+            statistics["doc_freqs"] = [a + b for a, b in zip(statistics["doc_freqs"], shard["doc_freqs"])]
+        return statistics
+
+    def score(self, query: str, context: str, ids: List[Optional[str]] = None, texts: List[str] = None) -> List[float]:
+        if ids is None and texts is None:
+            raise ValueError("A sharded index only scores candidate ids or texts")
+        ids = ids if ids is not None else [None] * len(texts)
+        query_terms = self.query_terms(query)
+        term_ids = [term_id for _, term_id in query_terms]
+        boosts = self.context_boosts(context, query_terms)
+
+        candidates = [doc_id for doc_id in ids if doc_id is not None]
+        groups = self.pool.partition(candidates) if candidates else {}
+        args_per_shard = [(term_ids, groups[shard_id][0] if shard_id in groups else [])
+                          for shard_id in range(self.pool.num_shards)]
+        shard_results = self.pool.scatter("lexical_frequencies", args_per_shard=args_per_shard)
+        statistics = self._sum_statistics([shard_statistics for shard_statistics, _ in shard_results], len(term_ids))
+        frequencies = {}
+        for _, shard_frequencies in shard_results:
+            frequencies.update(shard_frequencies)
+
+        candidate_frequencies = [
+            frequencies[doc_id] if doc_id in frequencies else self.text_frequencies(texts[i], query_terms)
+            for i, doc_id in enumerate(ids)
+        ]
+        return self.score_frequencies(query_terms, boosts, candidate_frequencies, statistics)
+
+    # Two rounds: the shards' statistics are summed, then every shard returns its top_k under
+    # those global statistics, so the merged top_k matches an unsharded index.
+    def search(self, query: str, context: str, top_k: int = 5) -> List[Dict]:
+        query_terms = self.query_terms(query)
+        term_ids = [term_id for _, term_id in query_terms]
+        boosts = self.context_boosts(context, query_terms)
+        statistics = self._sum_statistics(self.pool.scatter("lexical_statistics", term_ids), len(term_ids))
+        shard_results = self.pool.scatter("top_documents", query_terms, boosts, statistics, top_k)
+        merged = sorted((result for results in shard_results for result in results), key=lambda x: x[1], reverse=True)
+        return [
+            {"id": doc_id, "text": self.analyzer.decode(terms), "score": score}
+            for doc_id, score, terms in merged[:top_k]
+        ]
+
+
+# Serve a single shard, e.g. on another host:
+#   python -m src.retriever.sharding --shard 0 --listen 0.0.0.0:7000
+# and list the shard addresses under [SHARDING] ADDRESSES on the coordinator.
+def main():
+    from config import config
+    parser = argparse.ArgumentParser(description="Serve one shard of the knowledge base")
+    parser.add_argument("--shard", type=int, required=True, help="Shard number; selects the shard_<n> directory")
+    parser.add_argument("--listen", default="127.0.0.1:7000", help="host:port to listen on")
+    args = parser.parse_args()
+    authkey = config.get('SHARDING', 'AUTHKEY', fallback=None)
+    if not authkey:
+        parser.error("[SHARDING] AUTHKEY must be set to serve a shard")
+    serve_shard(
+        args.shard,
+        config.get('VECTOR_STORE', 'BACKEND', fallback='chroma').lower(),
+        config.get('SHARDING', 'PERSIST_DIRECTORY', fallback='./shards'),
+        config.get('VECTOR_STORE', 'DTYPE', fallback='float32'),
+        ShardPool._parse_address(args.listen),
+        authkey.encode("utf-8"),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict
+import numpy as np
+from numpy.lib.format import open_memmap
+from ..utils.instrumentation import instrumentation
+
+SNAPSHOT_VERSION = 1
+EMBEDDINGS_FILE = "embeddings.npy"
+RECORDS_FILE = "records.jsonl"
+MANIFEST_FILE = "document_manifest.db"
+INFO_FILE = "snapshot.json"
+
+logger = logging.getLogger(__name__)
+
+
+# A snapshot is a directory holding the knowledge base column by column:
+#   embeddings.npy          float32 matrix, one row per chunk, as the vector store holds them: from the
+#                           numpy backend these are normalised (and for int8 dequantised), not the originals
+#   records.jsonl           {"id", "text", "metadata"} per chunk, in the same order as the matrix rows
+#   document_manifest.db    the document manifest, which carries the lexical index (term ids and vocabulary)
+#   snapshot.json           counts, dimension and the embedding model that produced the vectors
+# Restoring loads stored vectors directly, so no document is re-extracted or re-embedded.
+def write_snapshot(vector_store, document_manifest, path: str, embedding_model: str = None,
+                   batch_size: int = 1000) -> Dict:
+    os.makedirs(path, exist_ok=True)
+    start = time.perf_counter()
+    expected = vector_store.count()
+    matrix = None
+    dim = None
+    count = 0
+    with instrumentation.span("snapshot.write"), open(os.path.join(path, RECORDS_FILE), "w", encoding="utf-8") as records:
+        for doc in vector_store.iter_documents(batch_size=batch_size, include=["documents", "metadatas", "embeddings"]):
+            if matrix is None:
+                dim = len(doc["embedding"])
+                matrix = open_memmap(os.path.join(path, EMBEDDINGS_FILE), mode="w+", dtype=np.float32,
+                                     shape=(expected, dim))
+            if count == expected:
+                raise RuntimeError("The knowledge base grew while the snapshot was being written")
+            matrix[count] = doc["embedding"]
+            records.write(json.dumps({"id": doc["id"], "text": doc["text"], "metadata": doc["metadata"]},
+                                     ensure_ascii=False) + "\n")
+            count += 1
+    if count != expected:
+        raise RuntimeError(f"Expected {expected} chunks but read {count}; the knowledge base changed during the snapshot")
+    if matrix is not None:
+        matrix.flush()
+        del matrix
+
+    # sqlite's online backup gives a consistent copy even while the manifest is open
+    destination = sqlite3.connect(os.path.join(path, MANIFEST_FILE))
+    with destination:
+        document_manifest.conn.backup(destination)
+    destination.close()
+
+    info = {
+        "version": SNAPSHOT_VERSION,
+        "count": count,
+        "dim": dim,
+        "embedding_model": embedding_model,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(path, INFO_FILE), "w") as f:
+        json.dump(info, f, indent=2)
+    instrumentation.increment("snapshot.chunks_written", count)
+    logger.info("Wrote %d chunks to %s in %.1fs", count, path, time.perf_counter() - start)
+    return info
+
+
+def read_snapshot_info(path: str) -> Dict:
+    with open(os.path.join(path, INFO_FILE)) as f:
+        info = json.load(f)
+    if info.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {info.get('version')} in {path}")
+    return info
+
+
+# Manifest settings the snapshot was built with; manifests from before settings were recorded have none.
+def read_snapshot_settings(path: str) -> Dict[str, str]:
+    source = sqlite3.connect(os.path.join(path, MANIFEST_FILE))
+    try:
+        return dict(source.execute('SELECT key, value FROM settings').fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        source.close()
+
+
+# Everything that can be checked without loading the snapshot: its version, the embedding model,
+# that every file is present, that the embedding matrix has the rows the snapshot lists, and that
+# the manifest settings in settings (e.g. the analyzer options its term ids depend on) match
+# wherever the snapshot records them.
+# Run it before touching the live knowledge base, so a bad snapshot never replaces a good one.
+def validate_snapshot(path: str, embedding_model: str = None, settings: Dict[str, str] = None) -> Dict:
+    info = read_snapshot_info(path)
+    if embedding_model and info.get("embedding_model") and info["embedding_model"] != embedding_model:
+        raise ValueError(f"Snapshot embeddings were made with {info['embedding_model']}, "
+                         f"but the configured embedding model is {embedding_model}")
+    files = [RECORDS_FILE, MANIFEST_FILE] + ([EMBEDDINGS_FILE] if info["count"] else [])
+    missing = [name for name in files if not os.path.exists(os.path.join(path, name))]
+    if missing:
+        raise ValueError(f"Snapshot {path} is missing {', '.join(missing)}")
+    if info["count"]:
+        shape = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r").shape
+        if shape != (info["count"], info["dim"]):
+            raise ValueError(f"Snapshot {path} lists {info['count']} chunks of dimension {info['dim']}, "
+                             f"but its embedding matrix has shape {shape}")
+    if settings:
+        recorded = read_snapshot_settings(path)
+        changed = {key: recorded[key] for key in settings if key in recorded and recorded[key] != settings[key]}
+        if changed:
+            differences = ", ".join(f"{key} {built} (now {settings[key]})" for key, built in changed.items())
+            raise ValueError(f"Snapshot {path} was built with {differences}")
+    return info
+
+
+# Bulk-load a snapshot into an empty vector store and replace the document manifest with the
+# snapshot's copy. Embeddings are read from a memory map and upserted in large batches.
+def restore_snapshot(vector_store, document_manifest, path: str, embedding_model: str = None,
+                     settings: Dict[str, str] = None, batch_size: int = 5000) -> Dict:
+    info = validate_snapshot(path, embedding_model, settings)
+    if vector_store.count():
+        raise ValueError("Restore needs an empty knowledge base; clear it first")
+
+    start = time.perf_counter()
+    count = 0
+    with instrumentation.span("snapshot.restore"):
+        if info["count"]:
+            matrix = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+            with open(os.path.join(path, RECORDS_FILE), encoding="utf-8") as records:
+                ids, texts, metadatas = [], [], []
+                for line in records:
+                    record = json.loads(line)
+                    ids.append(record["id"])
+                    texts.append(record["text"])
+                    # Chroma rejects empty metadata dicts
+                    metadatas.append(record["metadata"] or None)
+                    if len(ids) == batch_size:
+                        vector_store.add_embeddings(ids, texts, matrix[count:count + len(ids)], metadatas)
+                        count += len(ids)
+                        ids, texts, metadatas = [], [], []
+                if ids:
+                    vector_store.add_embeddings(ids, texts, matrix[count:count + len(ids)], metadatas)
+                    count += len(ids)
+        if count != info["count"]:
+            raise ValueError(f"Snapshot {path} lists {info['count']} chunks but holds {count}")
+
+        source = sqlite3.connect(os.path.join(path, MANIFEST_FILE))
+        with source:
+            source.backup(document_manifest.conn)
+        source.close()
+    instrumentation.increment("snapshot.chunks_restored", count)
+    logger.info("Restored %d chunks from %s in %.1fs", count, path, time.perf_counter() - start)
+    return info
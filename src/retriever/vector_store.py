@@ -1,7 +1,23 @@
-from typing import Dict, List
+from typing import Dict, Iterator, List, Sequence
 import chromadb
 from chromadb.config import Settings
 from sklearn.metrics.pairwise import cosine_similarity
+import logging
+from ..utils.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = {"documents": "text", "metadatas": "metadata", "embeddings": "embedding"}
+
+
+# Turn a column-oriented get() result into one dict per document.
+def page_records(page: Dict, include: Sequence[str]) -> Iterator[Dict]:
+    for i, doc_id in enumerate(page["ids"]):
+        record = {"id": doc_id}
+        for field in include:
+            value = page[field][i]
+            record[RECORD_FIELDS[field]] = value.tolist() if hasattr(value, "tolist") else value
+        yield record
 
 class VectorStore:
     def __init__(self, 
@@ -12,57 +28,106 @@ class VectorStore:
         self.embedding_provider = embedding_provider
 
     def add_documents(self, texts: list[str],  metadata: list[dict] = None, ids: list[str] = None):
-        print(f"DEBUG VECTOR STORE ADD DOCUMENTS: Adding {len(texts)} documents to the collection")
+        logger.debug("Adding %d documents to the collection", len(texts))
         if ids is None:
             ids = [f"doc_{i}" for i in range(len(texts))]
         embeddings = self.embedding_provider.generate_embeddings(texts, "")
-        self.collection.upsert(
-            documents=texts,
-            embeddings=embeddings,
-            metadatas=metadata if metadata else [{}] * len(texts),
-            ids=ids
-        )
+        with instrumentation.span("chroma.upsert"):
+            self.collection.upsert(
+                documents=texts,
+                embeddings=embeddings,
+                metadatas=metadata if metadata else None,
+                ids=ids
+            )
+
+    # Upsert documents whose embeddings were computed elsewhere, skipping the embedding provider.
+    # Large inputs are split into the biggest batches the Chroma client accepts.
+    def add_embeddings(self, ids: List[str], texts: List[str], embeddings, metadata: List[Dict] = None):
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            with instrumentation.span("chroma.upsert"):
+                self.collection.upsert(
+                    documents=texts[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadata[start:end] if metadata else None,
+                    ids=ids[start:end]
+                )
 
     # similarity search using cosine similarity. 
-    def similarity_search(self, query:str, context:str, top_k: int = 5) -> List[str]:
+    def similarity_search(self, query:str, context:str, top_k: int = 5) -> List[Dict]:
         query_embedding = self.embedding_provider.generate_embeddings([query], context)[0]
+        return self.query_embedding(query_embedding, top_k)
+
+    def query_embedding(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
         # Calculate cosine similarity between query embedding and all document embeddings
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k
-        )
-        return [{"text": doc, "score": score} for doc, score in zip(results["documents"][0], results["distances"][0])]
+        with instrumentation.span("chroma.query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k
+            )
+        return [
+            {"id": doc_id, "text": doc, "score": score}
+            for doc_id, doc, score in zip(results["ids"][0], results["documents"][0], results["distances"][0])
+        ]
 
     def query(self, query_embedding: list[float], n_results: int = 5):
-        print(f"DEBUG: Collection: {self.collection}")
-        print(f"DEBUG: Query embedding shape: {len(query_embedding)}")
-        print(f"DEBUG: Number of results requested: {n_results}")
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
+        logger.debug("Querying %s with a %d-dimensional embedding for %d results",
+                     self.collection.name, len(query_embedding), n_results)
+        with instrumentation.span("chroma.query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results
+            )
         return results
     
     def remove_documents(self, ids: List[str]):
-        self.collection.delete(ids=ids)
+        with instrumentation.span("chroma.delete"):
+            self.collection.delete(ids=ids)
 
     def update_document(self, id: str, text: str, metadata: Dict = None):
         embedding = self.embedding_provider.generate_embeddings([text], "")
-        self.collection.update(
-            ids=[id],
-            documents=[text],
-            embeddings=[embedding],
-            metadatas=[metadata] if metadata else None
-        )
+        with instrumentation.span("chroma.update"):
+            self.collection.update(
+                ids=[id],
+                documents=[text],
+                embeddings=embedding,
+                metadatas=[metadata] if metadata else None
+            )
 
+    # Refresh metadata in place without re-embedding the documents.
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]):
+        with instrumentation.span("chroma.update"):
+            self.collection.update(ids=ids, metadatas=metadatas)
 
     def get_all_documents(self):
         return self.collection.get()
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    # One page of the collection. include selects any of "documents", "metadatas" and "embeddings";
+    # ids are always returned.
+    def get_documents(self, limit: int, offset: int = 0, include: Sequence[str] = ("documents", "metadatas")) -> Dict:
+        with instrumentation.span("chroma.get"):
+            return self.collection.get(limit=limit, offset=offset, include=list(include))
+
+    # Stream the collection one page at a time, so listing or exporting it runs in constant memory.
+    # Yields {"id", "text", "metadata", "embedding"} dicts with only the included fields.
+    # Chroma only pages by offset and each page re-scans the rows before it, so a full pass is
+    # quadratic in the collection size; the numpy backend pages by row cursor instead.
+    def iter_documents(self, batch_size: int = 1000, include: Sequence[str] = ("documents", "metadatas")) -> Iterator[Dict]:
+        offset = 0
+        while True:
+            page = self.get_documents(limit=batch_size, offset=offset, include=include)
+            yield from page_records(page, include)
+            if len(page["ids"]) < batch_size:
+                return
+            offset += batch_size
     
     def get_document_by_id(self, id: str):
-        result = self.collection.get(ids=[id])
-        print(f"DEBUG: get_document_by_id result for {id}: {result}")  # Add this debug line
-        return result
+        with instrumentation.span("chroma.get"):
+            return self.collection.get(ids=[id])
     
     def clear_database(self):
         self.client.reset()
@@ -1,10 +1,16 @@
 from serpapi import GoogleSearch
 from typing import Dict, List
 from config import config
+import logging
+from ..utils.instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
 
 class WebSearch:
     def __init__(self):
         self.api_key = config.get('API', 'SERPAPI_API_KEY')
+        # Optional override of the SerpAPI endpoint, e.g. a local stand-in for benchmarking
+        self.backend = config.get('API', 'SERPAPI_BACKEND', fallback=None)
         
         if not self.api_key:
             raise ValueError("SERPAPI_API_KEY is not set in the configuration")
@@ -19,7 +25,10 @@ class WebSearch:
 
         try:
             search = GoogleSearch(params)
-            results = search.get_dict()
+            if self.backend:
+                search.BACKEND = self.backend
+            with instrumentation.span("serpapi.search"):
+                results = search.get_dict()
 
             formatted_results = []
             for item in results.get("organic_results", [])[:max_results]:
@@ -29,7 +38,7 @@ class WebSearch:
                     "url": item.get("link")
                 })
 
-            print(f"INFO: Found {len(formatted_results)} results")
+            logger.debug("Found %d results", len(formatted_results))
             return formatted_results
 
         except Exception as e:
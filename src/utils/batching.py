@@ -0,0 +1,76 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List
+from .instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+# Coalesces single-item requests from concurrent callers into batched backend calls. A worker
+# thread waits for the first item, keeps collecting for up to max_wait_ms or until max_batch_size
+# items are queued, calls batch_fn once and resolves each caller's future with its own result.
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "batch"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        if self._closed:
+            raise RuntimeError(f"{self.name} batcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._queue.put(None)
+                    break
+                batch.append(entry)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        items = [item for item, _ in batch]
+        labels = {"batcher": self.name}
+        instrumentation.increment("batching.batches", labels=labels)
+        instrumentation.increment("batching.items", len(items), labels)
+        try:
+            with instrumentation.span("batching.dispatch", labels):
+                results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise ValueError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error("%s batch of %d failed: %s", self.name, len(items), e)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
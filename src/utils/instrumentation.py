@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import contextlib
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+class _Span:
+    __slots__ = ("instrumentation", "key", "start")
+
+    def __init__(self, instrumentation, key):
+        self.instrumentation = instrumentation
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation._observe(self.key, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+# Aggregates timing spans and counters in process. When disabled, span() hands back a shared
+# no-op context manager and increment() returns immediately, so instrumented code pays nothing.
+class Instrumentation:
+    def __init__(self, enabled: bool = True, buckets_ms: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.enabled = enabled
+        self.buckets_ms = tuple(buckets_ms)
+        self.exporter = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+
+    def span(self, name: str, labels: Dict[str, str] = None):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, _key(name, labels))
+
+    def observe(self, name: str, duration_ms: float, labels: Dict[str, str] = None):
+        if self.enabled:
+            self._observe(_key(name, labels), duration_ms)
+
+    def _observe(self, key, duration_ms: float):
+        with self._lock:
+            stats = self.timings.get(key)
+            if stats is None:
+                stats = self.timings[key] = {
+                    "count": 0, "total_ms": 0.0, "min_ms": float("inf"), "max_ms": 0.0,
+                    "buckets": [0] * (len(self.buckets_ms) + 1),
+                }
+            stats["count"] += 1
+            stats["total_ms"] += duration_ms
+            stats["min_ms"] = min(stats["min_ms"], duration_ms)
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["buckets"][bisect.bisect_left(self.buckets_ms, duration_ms)] += 1
+
+    def increment(self, name: str, value: float = 1, labels: Dict[str, str] = None):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "timings": [
+                    {"name": name, "labels": dict(labels), **{k: (list(v) if k == "buckets" else v) for k, v in stats.items()}}
+                    for (name, labels), stats in sorted(self.timings.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "buckets_ms": list(self.buckets_ms),
+            }
+
+    def export(self):
+        if self.enabled and self.exporter is not None:
+            self.exporter.export(self.snapshot())
+
+
+class LogExporter:
+    def __init__(self, log: logging.Logger = logger):
+        self.log = log
+
+    def export(self, snapshot: Dict):
+        for timing in snapshot["timings"]:
+            self.log.info("span %s%s count=%d mean=%.2fms max=%.2fms", timing["name"], _format_labels(timing["labels"]),
+                          timing["count"], timing["total_ms"] / timing["count"], timing["max_ms"])
+        for counter in snapshot["counters"]:
+            self.log.info("counter %s%s value=%s", counter["name"], _format_labels(counter["labels"]), counter["value"])
+
+
+class PrometheusExporter:
+    def __init__(self, path: str = None, prefix: str = "rag"):
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, snapshot: Dict) -> str:
+        lines = []
+        seen = set()
+        for timing in snapshot["timings"]:
+            name = self._metric_name(timing["name"]) + "_seconds"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(snapshot["buckets_ms"] + ["+Inf"], timing["buckets"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(bound / 1000)
+                lines.append(f"{name}_bucket{_format_labels(timing['labels'], le=le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(timing['labels'])} {timing['total_ms'] / 1000}")
+            lines.append(f"{name}_count{_format_labels(timing['labels'])} {timing['count']}")
+        for counter in snapshot["counters"]:
+            name = self._metric_name(counter["name"]) + "_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(counter['labels'])} {counter['value']}")
+        return "\n".join(lines) + "\n"
+
+    def _metric_name(self, name: str) -> str:
+        return f"{self.prefix}_{name}".replace(".", "_").replace("-", "_")
+
+    # Written atomically so a node_exporter textfile collector never reads a partial file
+    def export(self, snapshot: Dict):
+        text = self.render(snapshot)
+        if self.path is None:
+            print(text, end="")
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+
+class JSONExporter:
+    def __init__(self, path: str = None):
+        self.path = path
+
+    def export(self, snapshot: Dict):
+        if self.path is None:
+            print(json.dumps(snapshot))
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _format_labels(labels: Dict[str, str], **extra) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+EXPORTERS = {"log": LogExporter, "prometheus": PrometheusExporter, "json": JSONExporter}
+
+
+# Apply the [METRICS] and [LOGGING] configuration sections to the shared instance. Handlers are
+# left to the application entry point; this only sets the level of the package's loggers.
+def configure(config):
+    instrumentation.enabled = config.get('METRICS', 'ENABLED', fallback='true').lower() == 'true'
+    exporter = config.get('METRICS', 'EXPORTER', fallback='').lower()
+    if exporter == 'log':
+        instrumentation.exporter = LogExporter()
+    elif exporter in EXPORTERS:
+        instrumentation.exporter = EXPORTERS[exporter](config.get('METRICS', 'EXPORT_PATH', fallback=None))
+    elif exporter:
+        raise ValueError(f"Unknown metrics exporter: {exporter}")
+    else:
+        instrumentation.exporter = None
+
+    debug = config.get('LOGGING', 'DEBUG', fallback='false').lower() == 'true'
+    logging.getLogger('src').setLevel(logging.DEBUG if debug else logging.INFO)
+
+
+# Shared instance used by every pipeline component
+instrumentation = Instrumentation()
@@ -0,0 +1,57 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from src.context.context_manager import ContextManager
+from src.pipeline.pipeline import ContextualRAGPipeline
+from src.preprocess.analyzer import TextAnalyzer
+from src.retriever.contextual_bm25 import ContextualBM25
+from src.retriever.contextual_embeddings import ContextualEmbeddings, EmbeddingProvider
+from src.retriever.document_manifest import DocumentManifest
+from src.retriever.numpy_vector_store import NumpyVectorStore
+
+
+# Deterministic vectors derived from the text, counting every text it is asked to embed.
+class StubEmbeddings(EmbeddingProvider):
+    def __init__(self, dim: int = 8):
+        self.dim = dim
+        self.embedded = []
+
+    def generate_embeddings(self, texts, context):
+        self.embedded.extend(texts)
+        return [np.random.default_rng(int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)).standard_normal(self.dim)
+                for text in texts]
+
+
+# One chunk per paragraph, so tests control chunk boundaries without NLTK data.
+class ParagraphChunker:
+    def chunk_text(self, text):
+        return [paragraph.strip() for paragraph in text.split("\n\n") if paragraph.strip()]
+
+
+# A pipeline over a local numpy index and manifest, without the model-backed components.
+@pytest.fixture
+def make_pipeline():
+    pipelines = []
+
+    def make(directory, embedding_model="nomic-embed-text"):
+        pipeline = ContextualRAGPipeline.__new__(ContextualRAGPipeline)
+        pipeline.shard_pool = None
+        pipeline.index_layout_error = None
+        pipeline.embedding_model = embedding_model
+        pipeline.context_manager = ContextManager(db_path=":memory:")
+        pipeline.contextual_embeddings = ContextualEmbeddings(StubEmbeddings(), contextualizer="{text}")
+        pipeline.vector_store = NumpyVectorStore(persist_directory=os.path.join(directory, "index"),
+                                                 embedding_provider=pipeline.contextual_embeddings)
+        pipeline.document_manifest = DocumentManifest(os.path.join(directory, "manifest.db"))
+        pipeline.text_chunker = ParagraphChunker()
+        pipeline.text_analyzer = TextAnalyzer()
+        pipeline.contextual_bm25 = ContextualBM25(analyzer=pipeline.text_analyzer)
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.close()
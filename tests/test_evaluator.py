@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from src.evaluation.evaluator import Evaluator
+
+
+class FailingPipeline:
+    document_manifest = SimpleNamespace(fingerprint=lambda: "kb")
+
+    def retrieval_settings(self):
+        return {}
+
+    def retrieve(self, query, context_manager):
+        if query == "bad":
+            raise RuntimeError("backend down")
+        return {"results": [], "context": ""}
+
+
+def test_failed_query_is_scored_as_a_miss():
+    report = Evaluator(FailingPipeline(), max_workers=2).evaluate(["good", "bad"], ["", "answer"])
+
+    assert "error" not in report["results"][0]
+    assert report["results"][1]["error"] == "RuntimeError: backend down"
+    assert report["results"][1]["generated_answer"] == ""
+    assert report["metrics"]["failed_queries"] == 1
+    assert report["metrics"]["exact_match"] == 0.5
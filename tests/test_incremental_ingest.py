@@ -0,0 +1,90 @@
+import numpy as np
+
+
+DOCUMENT = "alpha paragraph about cats\n\nbeta paragraph about dogs\n\ngamma paragraph about birds"
+
+
+def stored_ids(pipeline):
+    return {doc["id"] for doc in pipeline.vector_store.iter_documents(include=[])}
+
+
+def assert_in_sync(pipeline, file_name):
+    ids = set(pipeline.document_manifest.get_chunks(file_name))
+    assert stored_ids(pipeline) == ids
+    assert set(pipeline.contextual_bm25.doc_ids) == ids
+
+
+def test_unchanged_document_embeds_nothing(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    assert pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+    assert len(pipeline.contextual_embeddings.provider.embedded) == 3
+
+    assert pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+    assert len(pipeline.contextual_embeddings.provider.embedded) == 3
+    assert_in_sync(pipeline, "notes.md")
+
+
+def test_edit_embeds_only_the_changed_chunk(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+    before = pipeline.document_manifest.get_chunks("notes.md")
+
+    pipeline.add_document(DOCUMENT.replace("dogs", "wolves"), {"file_name": "notes.md"})
+
+    assert pipeline.contextual_embeddings.provider.embedded[3:] == ["beta paragraph about wolves"]
+    after = pipeline.document_manifest.get_chunks("notes.md")
+    assert len(set(before) & set(after)) == 2
+    stale = (set(before) - set(after)).pop()
+    assert pipeline.vector_store.get_document_by_id(stale)["ids"] == []
+    assert pipeline.contextual_bm25.missing_ids([stale]) == [stale]
+    assert pipeline.contextual_bm25.search("dogs", "", top_k=3)[0]["score"] == 0
+    assert_in_sync(pipeline, "notes.md")
+
+
+def test_shrinking_document_keeps_indexes_in_sync(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+
+    pipeline.add_document("alpha paragraph about cats", {"file_name": "notes.md"})
+
+    assert len(pipeline.contextual_embeddings.provider.embedded) == 3
+    assert pipeline.vector_store.count() == len(pipeline.contextual_bm25.doc_ids) == 1
+    assert_in_sync(pipeline, "notes.md")
+
+
+def test_metadata_change_refreshes_kept_chunks(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md", "author": "a"})
+
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md", "author": "b"})
+
+    assert len(pipeline.contextual_embeddings.provider.embedded) == 3
+    page = pipeline.vector_store.get_documents(limit=10)
+    assert [metadata["author"] for metadata in page["metadatas"]] == ["b"] * 3
+
+
+def test_legacy_positional_ids_are_replaced(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    chunks = DOCUMENT.split("\n\n")
+    legacy_ids = [f"doc_notes.md_{i}" for i in range(len(chunks))]
+    pipeline.vector_store.add_embeddings(legacy_ids, chunks, np.random.default_rng(0).random((3, 8)),
+                                         [{"file_name": "notes.md", "total_chunks": 3}] * 3)
+    pipeline.contextual_bm25.add_documents(chunks, legacy_ids)
+
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+
+    assert not stored_ids(pipeline) & set(legacy_ids)
+    assert pipeline.contextual_bm25.missing_ids(legacy_ids) == legacy_ids
+    assert pipeline.vector_store.count() == 3
+    assert_in_sync(pipeline, "notes.md")
+
+
+def test_remove_document_clears_every_index(tmp_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path))
+    pipeline.add_document(DOCUMENT, {"file_name": "notes.md"})
+    pipeline.add_document("kept paragraph", {"file_name": "other.md"})
+
+    assert pipeline.remove_document("notes.md")
+
+    assert pipeline.document_manifest.list_documents() == ["other.md"]
+    assert_in_sync(pipeline, "other.md")
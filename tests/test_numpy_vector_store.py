@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.retriever.numpy_vector_store import NumpyVectorStore
+
+
+def make_store(directory, count=100, dim=8):
+    store = NumpyVectorStore(persist_directory=str(directory))
+    ids = [f"doc_{i}" for i in range(count)]
+    vectors = np.random.default_rng(0).standard_normal((count, dim))
+    store.add_embeddings(ids, ids, vectors)
+    return store, ids, vectors
+
+
+def test_removing_past_ratio_compacts(tmp_path):
+    store, ids, vectors = make_store(tmp_path)
+    store.remove_documents(ids[:20])
+    assert store.size == 100
+
+    store.remove_documents(ids[20:30])
+    assert store.size == store.count() == 70
+    assert store.query_embedding(vectors[50], 1)[0]["id"] == "doc_50"
+
+    reopened = NumpyVectorStore(persist_directory=str(tmp_path))
+    assert reopened.count() == 70
+    assert reopened.query_embedding(vectors[99], 1)[0]["id"] == "doc_99"
+    assert [name for name in os.listdir(reopened.persist_directory) if name.startswith("embeddings")] == [reopened.matrix_file]
+
+
+def test_failed_compaction_keeps_the_old_index(tmp_path, monkeypatch):
+    store, ids, vectors = make_store(tmp_path)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(store, "_set_meta", fail)
+    with pytest.raises(RuntimeError):
+        store.remove_documents(ids[:50])
+
+    reopened = NumpyVectorStore(persist_directory=str(tmp_path))
+    assert reopened.size == 100 and reopened.count() == 50
+    assert reopened.query_embedding(vectors[60], 1)[0]["id"] == "doc_60"
@@ -0,0 +1,11 @@
+from src.generator.prompt_budget import PromptBudget, format_history
+
+
+def test_fit_history_keeps_the_current_query_and_the_most_relevant_turns():
+    budget = PromptBudget()
+    entries = [(0.2, "old question", "old answer " * 20), (0.8, "related question", "related answer"),
+               (1.0, "current | question", None)]
+    assert budget.fit_history(entries, 1000) == format_history(entries)
+
+    fitted = budget.fit_history(entries, budget.count_tokens(format_history(entries[1:])) + 1)
+    assert fitted == "0.80 * Q: related question A: related answer | 1.00 * Q: current | question"
@@ -0,0 +1,18 @@
+import numpy as np
+
+from src.retriever.sharding import ShardClient, ShardPool
+
+
+def test_second_coordinator_is_served_while_the_first_is_connected(tmp_path):
+    pool = ShardPool(num_shards=1, backend="numpy", persist_directory=str(tmp_path), authkey=b"secret")
+    try:
+        pool.call(0, "add_embeddings", ["doc_a"], ["a"], np.ones((1, 4)), [{}])
+        second = ShardClient(pool.clients[0].address, b"secret", 0)
+        try:
+            assert second.call("count") == 1
+            second.call("remove_documents", ["doc_a"])
+        finally:
+            second.close()
+        assert pool.call(0, "count") == 0
+    finally:
+        pool.close()
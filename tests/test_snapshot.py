@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from src.retriever.snapshot import EMBEDDINGS_FILE, INFO_FILE
+
+
+def ingest(pipeline, file_name, texts):
+    chunk_entries = pipeline.document_manifest.chunk_ids(file_name, texts)
+    ids = [chunk_id for chunk_id, _ in chunk_entries]
+    term_arrays = [pipeline.text_analyzer.term_ids(text) for text in texts]
+    pipeline.vector_store.add_embeddings(ids, texts, np.random.default_rng(0).random((len(texts), 8)),
+                                         [{"file_name": file_name}] * len(texts))
+    pipeline.contextual_bm25.add_term_ids(ids, term_arrays)
+    pipeline.document_manifest.save_terms(pipeline.text_analyzer.terms)
+    pipeline.document_manifest.save_document(file_name, file_name, chunk_entries, term_arrays)
+    return ids
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, make_pipeline):
+    source = make_pipeline(str(tmp_path / "source"))
+    ingest(source, "snapshot.md", ["restored chunk one", "restored chunk two"])
+    path = str(tmp_path / "snapshot")
+    source.create_snapshot(path)
+    return path
+
+
+def assert_intact(pipeline, ids):
+    assert pipeline.vector_store.count() == len(ids)
+    assert pipeline.document_manifest.list_documents() == ["live.md"]
+    assert pipeline.contextual_bm25.missing_ids(ids) == []
+
+
+def test_restore_replaces_knowledge_base(tmp_path, snapshot_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path / "live"))
+    ingest(pipeline, "live.md", ["live chunk"])
+
+    pipeline.restore_snapshot(snapshot_path)
+
+    assert pipeline.vector_store.count() == 2
+    assert pipeline.document_manifest.list_documents() == ["snapshot.md"]
+    assert pipeline.contextual_bm25.search("restored", "", top_k=2)[0]["score"] > 0
+
+
+def test_mismatched_embedding_model_leaves_knowledge_base_intact(tmp_path, snapshot_path, make_pipeline):
+    pipeline = make_pipeline(str(tmp_path / "live"), embedding_model="another-model")
+    ids = ingest(pipeline, "live.md", ["live chunk"])
+
+    with pytest.raises(ValueError, match="embedding model"):
+        pipeline.restore_snapshot(snapshot_path)
+    assert_intact(pipeline, ids)
+
+
+def test_unsupported_version_leaves_knowledge_base_intact(tmp_path, snapshot_path, make_pipeline):
+    info_path = os.path.join(snapshot_path, INFO_FILE)
+    with open(info_path) as f:
+        info = json.load(f)
+    with open(info_path, "w") as f:
+        json.dump({**info, "version": info["version"] + 1}, f)
+    pipeline = make_pipeline(str(tmp_path / "live"))
+    ids = ingest(pipeline, "live.md", ["live chunk"])
+
+    with pytest.raises(ValueError, match="version"):
+        pipeline.restore_snapshot(snapshot_path)
+    assert_intact(pipeline, ids)
+
+
+def test_missing_file_leaves_knowledge_base_intact(tmp_path, snapshot_path, make_pipeline):
+    os.remove(os.path.join(snapshot_path, EMBEDDINGS_FILE))
+    pipeline = make_pipeline(str(tmp_path / "live"))
+    ids = ingest(pipeline, "live.md", ["live chunk"])
+
+    with pytest.raises(ValueError, match="missing"):
+        pipeline.restore_snapshot(snapshot_path)
+    assert_intact(pipeline, ids)
+
+
+def test_mismatched_analyzer_leaves_knowledge_base_intact(tmp_path, make_pipeline):
+    source = make_pipeline(str(tmp_path / "source"))
+    ingest(source, "snapshot.md", ["restored chunk one"])
+    stem = source.analyzer_settings()["stem"]
+    source.document_manifest.set_setting("stem", "false" if stem == "true" else "true")
+    path = str(tmp_path / "snapshot")
+    source.create_snapshot(path)
+    pipeline = make_pipeline(str(tmp_path / "live"))
+    ids = ingest(pipeline, "live.md", ["live chunk"])
+
+    with pytest.raises(ValueError, match="stem"):
+        pipeline.restore_snapshot(path)
+    assert_intact(pipeline, ids)